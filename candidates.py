@@ -0,0 +1,202 @@
+import random
+from typing import Dict, Iterable, Iterator, List, Set, Tuple, Union
+from util import np, countTuples, getTuple
+from fd.pddl.actions import Action
+from fd.pddl.conditions import Atom, NegatedAtom, Literal
+from fd.pddl.predicates import Predicate
+
+
+class CandidateIndex:
+    """Atoms that can be inserted into the actions of a domain.
+
+    The candidates of an action depend only on the predicates
+    of the domain and the parameters of the action, so one index
+    is built per parsed domain and shared by all of its clones.
+    Actions are looked up by name, and the candidates of an action
+    are numbered, never listed: num_mutants and mutants enumerate
+    them by code, and sample draws one without building the rest."""
+
+    def __init__(self, predicates: List[Predicate]) -> None:
+        self._predicates = list(filter(
+            lambda p: p.name != "=",
+            predicates))
+        self._variables = dict()
+        self._shapes = dict()
+
+    def variables(self, action: Action) -> Dict[str, List[str]]:
+        """The parameters of the action grouped by their type."""
+        variables = self._variables.get(action.name)
+        if variables is None:
+            variables = dict()
+            for para in action.parameters:
+                variables.setdefault(para.type, []).append(para.name)
+            self._variables[action.name] = variables
+        return variables
+
+    def arguments(
+            self,
+            predicate: Predicate,
+            action: Action) -> Union[List[List[str]], None]:
+        """The variables of the action that can fill each argument
+        of the predicate, or None if some argument cannot be filled."""
+        variables = self.variables(action)
+        parameters = list()
+        for arg in predicate.arguments:
+            matching = variables.get(arg.type)
+            if matching is None:
+                return None
+            parameters.append(matching)
+        return parameters
+
+    def shape(
+            self,
+            action: Action) -> Tuple[Dict[str, List[List[str]]], int]:
+        """The arguments of every predicate that fits the action,
+        together with the number of candidate atoms per polarity."""
+        shape = self._shapes.get(action.name)
+        if shape is None:
+            arguments = dict()
+            for predicate in self._predicates:
+                args = self.arguments(predicate, action)
+                if args is not None:
+                    arguments[predicate.name] = args
+            total = sum(countTuples(args) for args in arguments.values())
+            shape = (arguments, total)
+            self._shapes[action.name] = shape
+        return shape
+
+    # Every candidate of an action is numbered by an integer code:
+    # the candidates of each fitting predicate take a contiguous
+    # range of codes, in which the argument tuple is numbered as
+    # by util.getTuple. Exhaustive enumeration works on arrays of
+    # codes and only builds atoms for the codes that are decoded.
+
+    def encode(
+            self,
+            action: Action,
+            atom: Literal) -> int:
+        """The code of a candidate atom, of either polarity."""
+        arguments, _ = self.shape(action)
+        offset = 0
+        for name, args in arguments.items():
+            if name == atom.predicate:
+                break
+            offset += countTuples(args)
+        code = 0
+        for arg, variables in zip(atom.args, args):
+            code = code * len(variables) + variables.index(arg)
+        return offset + code
+
+    def codes(
+            self,
+            action: Action,
+            negated: bool,
+            existing: Iterable[Literal] = ()):
+        """The codes, in increasing order, of the candidates
+        that are not in existing."""
+        _, total = self.shape(action)
+        excluded = set(self.encode(action, atom) for atom in existing
+                       if atom.negated == negated
+                       and self.contains(action, atom))
+        if np is None:
+            return [code for code in range(total)
+                    if code not in excluded]
+        dtype = np.min_scalar_type(total)
+        return np.setdiff1d(
+            np.arange(total, dtype=dtype),
+            np.array(sorted(excluded), dtype=dtype),
+            assume_unique=True)
+
+    def count(
+            self,
+            action: Action,
+            negated: bool,
+            existing: Iterable[Literal] = ()) -> int:
+        """The number of candidates that are not in existing."""
+        _, total = self.shape(action)
+        excluded = set(atom for atom in existing
+                       if atom.negated == negated
+                       and self.contains(action, atom))
+        return total - len(excluded)
+
+    def decode(
+            self,
+            action: Action,
+            negated: bool,
+            codes) -> Iterator[Union[Atom, NegatedAtom]]:
+        """Lazily build the atoms of the given codes."""
+        constructor = NegatedAtom if negated else Atom
+        arguments, _ = self.shape(action)
+        if np is None:
+            for code in codes:
+                for name, args in arguments.items():
+                    count = countTuples(args)
+                    if code < count:
+                        break
+                    code -= count
+                yield constructor(name, getTuple(args, code))
+            return
+        codes = np.asarray(codes)
+        offset = 0
+        for name, args in arguments.items():
+            count = countTuples(args)
+            lo, hi = np.searchsorted(codes, [offset, offset + count])
+            if lo < hi:
+                if args:
+                    positions = np.unravel_index(
+                        codes[lo:hi] - offset,
+                        [len(variables) for variables in args])
+                    columns = [
+                        np.asarray(variables, dtype=object)[pos]
+                        for pos, variables in zip(positions, args)]
+                    for t in zip(*columns):
+                        yield constructor(name, t)
+                else:
+                    yield constructor(name, ())
+            offset += count
+
+    def contains(
+            self,
+            action: Action,
+            atom: Literal) -> bool:
+        """Whether the atom, of either polarity, is a candidate."""
+        arguments, _ = self.shape(action)
+        args = arguments.get(atom.predicate)
+        if args is None or len(args) != len(atom.args):
+            return False
+        for arg, variables in zip(atom.args, args):
+            if arg not in variables:
+                return False
+        return True
+
+    def sample(
+            self,
+            action: Action,
+            negated: bool,
+            existing: Set[Literal]) -> Union[Atom, NegatedAtom]:
+        """Draw a candidate atom uniformly at random among those
+        not in existing, without listing all the candidates.
+
+        Raises IndexError if every candidate is in existing."""
+        arguments, total = self.shape(action)
+        remaining = self.count(action, negated, existing)
+        if remaining == 0:
+            raise IndexError("No candidate atom for {}".format(
+                action.name))
+        if 2 * remaining < total:
+            # rejection would mostly fail, but then only a
+            # few atoms (fewer than the existing ones) remain
+            return random.choice(list(self.decode(
+                action, negated,
+                self.codes(action, negated, existing))))
+        constructor = NegatedAtom if negated else Atom
+        while True:
+            idx = random.randrange(total)
+            for name, args in arguments.items():
+                count = countTuples(args)
+                if idx < count:
+                    break
+                idx -= count
+            atom = constructor(name, getTuple(args, idx))
+            if atom not in existing:
+                return atom
@@ -1,5 +1,10 @@
+import copy
+import contextlib
+
+from operations import Transaction
 from fd.pddl.pddl_file import parse_pddl_file
-from fd.pddl.tasks import parse_domain, parse_task
+from fd.pddl.conditions import Conjunction
+from fd.pddl.tasks import Requirements, parse_domain, parse_task
 
 
 class Domain:
@@ -12,21 +17,92 @@ class Domain:
          self.predicates, self.functions,
          self.actions, self.axioms) = parse_domain(domainPDDL)
 
-    def domain(self):
-        return ("(define (domain {domain_name})\n"
-                "{requirements}\n"
-                "(:types\n\t{types})\n"
-                "(:constants {constants})\n"
-                "(:predicates\n\t{predicates})\n"
-                "(:functions {functions})\n"
-                "{actions} )").format(
-            predicates='\n\t'.join(x.pddl() for x in self.predicates),
-            functions='\n\t'.join(x.pddl() for x in self.functions),
-            actions='\n\n'.join(x.pddl() for x in self.actions),
-            types='\n\t'.join(x.pddl() for x in self.types),
-            constants=' '.join(x.pddl() for x in self.constants),
-            domain_name=self.domain_name,
-            requirements=self.requirements.pddl())
+    def clone(self):
+        # Conditions and literals are immutable and shared with the
+        # clone; only the per-action effect lists and preconditions,
+        # which the fuzzer rewrites, belong to the clone alone.
+        domain = copy.copy(self)
+        domain.actions = []
+        for action in self.actions:
+            action = copy.copy(action)
+            action.effects = list(action.effects)
+            domain.actions.append(action)
+        return domain
+
+    @contextlib.contextmanager
+    def mutation(self):
+        # Operations applied through the yielded transaction
+        # are reverted when the block is left, so the domain
+        # can be mutated, written out and restored in place;
+        # they must apply to the actions of this domain.
+        transaction = Transaction(self.actions)
+        try:
+            yield transaction
+        finally:
+            transaction.rollback()
+
+    def domain(self, canonical=False):
+        return domain_pddl(
+            self.domain_name, self.requirements, self.types,
+            self.constants, self.predicates, self.functions,
+            self.actions, canonical)
+
+
+def _pddl_list(items, canonical):
+    texts = [x.pddl() for x in items]
+    if canonical:
+        texts.sort()
+    return texts
+
+
+def action_pddl(action, canonical=False):
+    # The parameters keep their order, which is the order of the
+    # arguments in plans; the parts of the precondition and the
+    # effects are sorted, as their order has no meaning.
+    if not canonical:
+        return action.pddl()
+    precondition = action.precondition
+    if isinstance(precondition, Conjunction):
+        precondition = '(and\n\t\t{0})'.format('\n\t\t'.join(
+            _pddl_list(precondition.parts, canonical)))
+    else:
+        precondition = precondition.pddl()
+    cost = ''
+    if action.cost is not None:
+        cost = action.cost.pddl()
+    return ("(:action {0}\n\t:parameters ({1})\n\t:precondition {2}"
+            "\n\t:effect (and\n\t\t{3}))").format(
+        action.name,
+        '\n\t\t'.join(param.pddl() for param in action.parameters),
+        precondition,
+        '\n\t\t'.join(_pddl_list(action.effects, canonical)) + cost)
+
+
+def domain_pddl(
+        domain_name, requirements, types, constants,
+        predicates, functions, actions, canonical=False):
+    """The text of a domain. In canonical mode, every list whose
+    order has no meaning is sorted, so that domains differing
+    only in the order of their declarations are byte-identical."""
+    actions = list(actions)
+    if canonical:
+        actions.sort(key=lambda action: action.name)
+        requirements = Requirements(sorted(requirements.requirements))
+    return ("(define (domain {domain_name})\n"
+            "{requirements}\n"
+            "(:types\n\t{types})\n"
+            "(:constants {constants})\n"
+            "(:predicates\n\t{predicates})\n"
+            "(:functions {functions})\n"
+            "{actions} )").format(
+        predicates='\n\t'.join(_pddl_list(predicates, canonical)),
+        functions='\n\t'.join(_pddl_list(functions, canonical)),
+        actions='\n\n'.join(
+            action_pddl(x, canonical) for x in actions),
+        types='\n\t'.join(_pddl_list(types, canonical)),
+        constants=' '.join(_pddl_list(constants, canonical)),
+        domain_name=domain_name,
+        requirements=requirements.pddl())
 
 
 class Task:
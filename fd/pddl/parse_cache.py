@@ -0,0 +1,138 @@
+"""Content-addressed on-disk cache of parsed PDDL files.
+
+Entries are the nested lists produced by the parser, pickled and
+stored under the SHA-256 hash of the file contents, so they can be
+shared by runs and processes. When the cache grows beyond its size
+bound, the least recently used entries are evicted."""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+# Part of every key: change it whenever the parser output changes.
+VERSION = b"nested-list-1"
+
+# The cache used by parse_pddl_file, if any (see configure).
+current = None
+
+class ParseCache(object):
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._size = self._scan()[1]
+
+    def key(self, filename):
+        digest = hashlib.sha256(VERSION)
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".pickle")
+
+    def load(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # A damaged entry is dropped and parsed again.
+            self._remove(path)
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # Most recently used.
+        except OSError:
+            pass
+        self.hits += 1
+        return result
+
+    def store(self, key, result):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(result, f, protocol=5)
+            size = os.path.getsize(tmp_path)
+            try:
+                # An entry replaced by this one no longer counts.
+                size -= os.path.getsize(path)
+            except OSError:
+                pass
+            # Atomic, so concurrent readers never see partial entries.
+            os.replace(tmp_path, path)
+            self._size += size
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _scan(self):
+        entries = []
+        size = 0
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if not entry.name.endswith(".pickle"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                size += stat.st_size
+        return entries, size
+
+    def _evict(self):
+        # Rescan, since other processes may share the directory,
+        # and evict down to 90% of the bound to amortize the scan.
+        entries, self._size = self._scan()
+        entries.sort()
+        for _, size, path in entries:
+            if self._size <= 0.9 * self.max_bytes:
+                break
+            if self._remove(path):
+                self._size -= size
+                self.evictions += 1
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def stats(self):
+        return (self.hits, self.misses, self.evictions)
+
+    def add_stats(self, stats):
+        # Counts of another process using the same directory.
+        hits, misses, evictions = stats
+        self.hits += hits
+        self.misses += misses
+        self.evictions += evictions
+
+    def report(self):
+        lookups = self.hits + self.misses
+        rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return ("parse cache: %d hits, %d misses (%.1f%% hit rate), "
+                "%d evictions, %.1f MB in %s" % (
+                    self.hits, self.misses, rate, self.evictions,
+                    self._size / 1e6, self.directory))
+
+def configure(directory, max_bytes):
+    global current
+    current = ParseCache(directory, max_bytes)
+    return current
@@ -1,19 +1,87 @@
-__all__ = ["ParseError", "parse_nested_list"]
+__all__ = ["ParseError", "parse_nested_list", "parse_nested_buffer"]
+
+import re
+import sys
 
 class ParseError(Exception):
     pass
 
 # Basic functions for parsing PDDL (Lisp) files.
 def parse_nested_list(input_file):
-    tokens = tokenize(input_file)
-    next_token = next(tokens)
+    if hasattr(input_file, "read"):
+        text = input_file.read()
+    else:
+        text = "".join(input_file)
+    tokens = iter(scan(text))
+    next_token = next(tokens, None)
     if next_token != "(":
         raise ParseError("Expected '(', got %s." % next_token)
-    result = list(parse_list_aux(tokens))
-    for tok in tokens:  # Check that generator is exhausted.
-        raise ParseError("Unexpected token: %s." % tok)
-    return result
+    return build_nested_list(tokens)
+
+COMMENT = re.compile(r";[^\n]*")
+
+def scan(text):
+    """Tokenize a whole buffer at once; gives the same tokens
+    as tokenize on the lines of the buffer."""
+    text = COMMENT.sub("", text).lower()
+    text = text.replace("(", " ( ").replace(")", " ) ").replace("?", " ?")
+    return text.split()
+
+def build_nested_list(tokens):
+    # Leading "(" has already been swallowed. Iterative, so
+    # deeply nested lists cannot exhaust the recursion limit.
+    result = []
+    current = result
+    stack = []
+    for token in tokens:
+        if token == "(":
+            stack.append(current)
+            current = []
+            stack[-1].append(current)
+        elif token == ")":
+            if not stack:
+                for tok in tokens:
+                    raise ParseError("Unexpected token: %s." % tok)
+                return result
+            current = stack.pop()
+        else:
+            current.append(token)
+    raise ParseError()
+
+COMMENT_BYTES = re.compile(rb";[^\n]*")
+CHUNK_SIZE = 1 << 20
+
+def scan_buffer(buffer):
+    """Tokenize a bytes-like buffer, such as a memory-mapped file,
+    chunk by chunk. Only symbols are decoded, once per distinct
+    spelling, and the resulting strings are interned."""
+    symbols = {b"(": "(", b")": ")"}
+    start = 0
+    length = len(buffer)
+    while start < length:
+        # Newlines end both tokens and comments.
+        end = buffer.find(b"\n", start + CHUNK_SIZE)
+        if end == -1:
+            end = length
+        chunk = COMMENT_BYTES.sub(b"", buffer[start:end])
+        chunk = chunk.replace(b"(", b" ( ").replace(b")", b" ) ")
+        for token in chunk.replace(b"?", b" ?").split():
+            symbol = symbols.get(token)
+            if symbol is None:
+                symbol = sys.intern(token.decode().lower())
+                symbols[token] = symbol
+            yield symbol
+        start = end
 
+def parse_nested_buffer(buffer):
+    tokens = scan_buffer(buffer)
+    next_token = next(tokens, None)
+    if next_token != "(":
+        raise ParseError("Expected '(', got %s." % next_token)
+    return build_nested_list(tokens)
+
+# The line-by-line tokenizer and the recursive list builder
+# are kept as the reference for scan and build_nested_list.
 def tokenize(input):
     for line in input:
         line = line.split(";", 1)[0]  # Strip comments.
@@ -34,3 +102,29 @@ def parse_list_aux(tokenstream):
             yield list(parse_list_aux(tokenstream))
         else:
             yield token
+
+if __name__ == "__main__":
+    # Benchmark: python parser.py file.pddl...
+    import sys
+    import time
+
+    def parse_reference(input_file):
+        tokens = tokenize(input_file)
+        next(tokens)
+        result = list(parse_list_aux(tokens))
+        for tok in tokens:
+            raise ParseError("Unexpected token: %s." % tok)
+        return result
+
+    for filename in sys.argv[1:]:
+        timings = []
+        results = []
+        for parse in (parse_reference, parse_nested_list):
+            start = time.perf_counter()
+            with open(filename) as input_file:
+                results.append(parse(input_file))
+            timings.append(time.perf_counter() - start)
+        assert results[0] == results[1], filename
+        print("%s: reference %.3fs, scanner %.3fs (%.1fx)" % (
+            filename, timings[0], timings[1],
+            timings[0] / max(timings[1], 1e-9)))
@@ -10,15 +10,37 @@ except ImportError:
 import sys
 import os.path
 import re
+import mmap
 
 from . import parser
+from . import parse_cache
 
 from . import tasks
 
+# Files at least this large are memory-mapped and tokenized as raw
+# bytes, which needs far less memory than reading them as text.
+MMAP_THRESHOLD = 1 << 20
+
+def _parse(filename):
+    if os.path.getsize(filename) >= MMAP_THRESHOLD:
+        with builtins.open(filename, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return parser.parse_nested_buffer(m)
+    # The builtin open function is shadowed by this module's open function.
+    with builtins.open(filename) as f:
+        return parser.parse_nested_list(f)
+
 def parse_pddl_file(type, filename):
     try:
-        # The builtin open function is shadowed by this module's open function.
-        return parser.parse_nested_list(builtins.open(filename))
+        cache = parse_cache.current
+        if cache is None:
+            return _parse(filename)
+        key = cache.key(filename)
+        result = cache.load(key)
+        if result is None:
+            result = _parse(filename)
+            cache.store(key, result)
+        return result
     except IOError as e:
         raise SystemExit("Error: Could not read file: %s\nReason: %s." %
                          (e.filename, e))
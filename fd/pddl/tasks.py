@@ -98,7 +98,8 @@ class Task(object):
 
     def problem(self):
         metric = ""
-        objects = set(self.objects) - set(self.constants)
+        constants = set(self.constants)
+        objects = [obj for obj in self.objects if obj not in constants]
         if self.use_min_cost_metric:
             metric = "(:metric minimize (total-cost) )"
         result = "(define (problem {problem})\
@@ -106,8 +107,8 @@ class Task(object):
                (:objects {0}) \
                (:init {1}) \
                (:goal {2}) \
-               {metric})".format('\n'.join(x.pddl() for x in set(objects)),
-                                 '\n'.join(x.pddl() for x in set(self.init)),
+               {metric})".format('\n'.join(x.pddl() for x in dict.fromkeys(objects)),
+                                 '\n'.join(x.pddl() for x in dict.fromkeys(self.init)),
                                  self.goal.pddl(), metric=metric,
                                  problem=self.task_name,
                                  domain_name=self.domain_name)
@@ -227,7 +228,9 @@ def parse_task(task_pddl):
 
     assert init[0] == ":init"
     initial = []
-    initial_true = set()
+    # a dict rather than a set, so that the initial state
+    # keeps the order of the task file across runs
+    initial_true = dict()
     initial_false = set()
     initial_assignments = dict()
     for fact in init[1:]:
@@ -256,7 +259,7 @@ def parse_task(task_pddl):
         else:
             atom = conditions.Atom(fact[0], fact[1:])
             check_atom_consistency(atom, initial_true, initial_false)
-            initial_true.add(atom)
+            initial_true[atom] = None
     initial.extend(initial_true)
     yield initial
 
@@ -2,93 +2,77 @@ import os
 import random
 import math
 from options import setup
-from util import getAllTuples
-from typing import List, Union
+from typing import Optional, Tuple, Union
 from domain import Domain
+from candidates import CandidateIndex
 from operations import *
 from fd.pddl.actions import Action
 from fd.pddl.conditions import Atom, NegatedAtom
 from fd.pddl.conditions import Conjunction
 
 
+_parsed_domains = dict()
+
+
+def _parsed(domain_file: str) -> Tuple[Domain, CandidateIndex]:
+    path = os.path.abspath(domain_file)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _parsed_domains.get(path)
+    if cached is None or cached[0] != mtime:
+        domain = Domain(path)
+        cached = (mtime, domain, CandidateIndex(domain.predicates))
+        _parsed_domains[path] = cached
+    return cached[1], cached[2]
+
+
+def load_domain(domain_file: str) -> Domain:
+    """Return a mutable copy of the domain in domain_file.
+
+    The file is parsed only once per process (and again
+    if it changes on disk); every call hands out a clone
+    of that parse."""
+    domain, _ = _parsed(domain_file)
+    return domain.clone()
+
+
 class Fuzzer:
     def __init__(
             self, harden_rate: float,
             relax_rate: float,
-            domain_file: str) -> None:
-        self.domain = Domain(domain_file)
+            domain: Union[str, Domain],
+            index: Optional[CandidateIndex] = None) -> None:
+        if isinstance(domain, Domain):
+            self.domain = domain
+            domain = domain.domain_name
+            if index is None:
+                index = CandidateIndex(self.domain.predicates)
+        else:
+            template, cached = _parsed(domain)
+            self.domain = template.clone()
+            if index is None:
+                index = cached
+        self._index = index
         self.has_neg_prec = False
         if not self._validated():
-            raise InvalidDomainError(domain_file)
+            raise InvalidDomainError(domain)
         self._ops = []
-        self._fetch = (
-            lambda negated: lambda xs:
-            list(filter(lambda y: y.negated == negated,
-                        xs)))
-        self._filter = lambda xs: lambda x: x not in xs
+        # the effects of every action, kept up to date
+        # as effects are inserted and deleted
+        self._effects = dict()
+        for action in self.domain.actions:
+            self._effects[action.name] = set(
+                eff.literal for eff in action.effects)
         num_errors = math.ceil(len(self.domain.actions) * harden_rate)
         self._harden(num_errors)
         num_errors = math.ceil(len(self.domain.actions) * relax_rate)
         self._relax(num_errors)
 
-    def _atoms_for_insertion(
+    def _atom_for_insertion(
             self, negated: bool,
-            action: Action) -> List[Atom]:
-        atoms = [eff.literal for eff in action.effects]
-        existing = self._fetch(negated)(atoms)
-        atoms = self._atoms_matching_action(
-            negated, action)
-        atoms = list(filter(
-            self._filter(existing),
-            atoms))
-        atoms = list(filter(
-                lambda x: x.predicate != "=",
-                atoms))
-        return atoms
-
-    def _matching_vars(self, arg, action):
-        variables = [para for para in action.parameters]
-        variables = filter(
-            lambda v: v.type == arg.type,
-            variables)
-        variables = [v.name for v in variables]
-        return variables
-
-    def _parameters(self, predicate, action):
-        parameters = list()
-        for arg in predicate.arguments:
-            variables = self._matching_vars(
-                arg, action)
-            if not len(variables):
-                return None
-            parameters.append(variables)
-        return parameters
-
-    def _atoms_matching_action(
-            self,
-            negated: bool,
-            action: Action) -> List[Union[Atom, NegatedAtom]]:
-        atoms = []
-        for predicate in self.domain.predicates:
-            args = self._parameters(predicate, action)
-            if args is None:
-                continue
-            combinations = getAllTuples(args)
-            if negated:
-                constructor = (
-                    lambda n: lambda t:
-                    NegatedAtom(n, t))
-            else:
-                constructor = (
-                    lambda n: lambda t:
-                    Atom(n, t))
-            for t in combinations:
-                atom = constructor(predicate.name)(t)
-                atoms.append(atom)
-            atoms = list(filter(
-                lambda x: x.predicate != "=",
-                atoms))
-        return atoms
+            action: Action) -> Atom:
+        existing = self._effects[action.name]
+        return self._index.sample(
+            action, negated, existing)
 
     def _insert_eff(
             self,
@@ -96,18 +80,17 @@ class Fuzzer:
             atom: Atom) -> None:
         op = EffInsertion(action, atom)
         op.apply()
+        self._effects[action.name].add(atom)
         self._ops.append(op)
 
     def _insert_pos_eff(self, action: Action) -> None:
-        atoms = self._atoms_for_insertion(
+        atom = self._atom_for_insertion(
             False, action)
-        atom = random.choice(atoms)
         self._insert_eff(action, atom)
 
     def _insert_neg_eff(self, action: Action) -> None:
-        atoms = self._atoms_for_insertion(
+        atom = self._atom_for_insertion(
             True, action)
-        atom = random.choice(atoms)
         self._insert_eff(action, atom)
 
     def _delete_eff(
@@ -116,6 +99,8 @@ class Fuzzer:
             atom: Atom) -> None:
         op = EffDeletion(action, atom)
         op.apply()
+        if atom not in (eff.literal for eff in action.effects):
+            self._effects[action.name].discard(atom)
         self._ops.append(op)
 
     def _delete_pos_eff(self, action: Action) -> None:
@@ -145,17 +130,15 @@ class Fuzzer:
     def _insert_pos_prec(
             self,
             action: Action) -> None:
-        atoms = self._atoms_for_insertion(
+        atom = self._atom_for_insertion(
             False, action)
-        atom = random.choice(atoms)
         self._insert_prec(action, atom)
 
     def _insert_neg_prec(
             self,
             action: Action) -> None:
-        atoms = self._atoms_for_insertion(
+        atom = self._atom_for_insertion(
             True, action)
-        atom = random.choice(atoms)
         self._insert_prec(action, atom)
 
     def _delete_prec(
@@ -257,9 +240,9 @@ class Fuzzer:
             return False
         return True
 
-    def output_domain(self, outfile):
+    def output_domain(self, outfile, canonical=False):
         with open(outfile, "w") as f:
-            f.write(self.domain.domain())
+            f.write(self.domain.domain(canonical))
 
     def output_operations(self, outfile):
         with open(outfile, "w") as f:
@@ -269,8 +252,11 @@ class Fuzzer:
 
 if __name__ == "__main__":
     args = setup()
-    fuzzer = Fuzzer(args.rate, args.domain)
+    fuzzer = Fuzzer(args.rate, args.rate, args.domain)
     if args.outDomain is not None:
-        fuzzer.output_domain(args.outDomain)
+        fuzzer.output_domain(
+            os.path.join(args.outDomain, "domain.pddl"),
+            args.canonical)
     if args.outOperations is not None:
-        fuzzer.output_operations(args.outOperations)
+        fuzzer.output_operations(
+            os.path.join(args.outOperations, "fuzz_ops.txt"))
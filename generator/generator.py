@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 import logging
 import subprocess
 import options
@@ -9,6 +10,81 @@ import multiprocessing
 from typing import Dict, List, Tuple, Any
 from tqdm import tqdm
 
+
+def fuzzDomain(
+        job : Tuple[str, str, List[Tuple[float, str]], bool]
+        ) -> Tuple[List[str], List[str]]:
+    """Parse the domain once and fuzz every requested
+    (rate, output directory) pair from that parse.
+
+    Returns the output directories of the failed mutants
+    along with the error messages to be logged by the caller."""
+    fuzzerDir, domainFile, targets, canonical = job
+    if fuzzerDir not in sys.path:
+        sys.path.insert(0, fuzzerDir)
+    from domain import Domain
+    from fuzzer import Fuzzer
+    from candidates import CandidateIndex
+    try:
+        domain = Domain(domainFile)
+    except (Exception, SystemExit) as err:
+        msg = "{} - {}".format(domainFile, err)
+        return [outFileDir for _, outFileDir in targets], [msg]
+    index = CandidateIndex(domain.predicates)
+    failed = []
+    errors = []
+    for rate, outFileDir in targets:
+        try:
+            fuzzer = Fuzzer(
+                    rate, rate, domain.clone(), index)
+            fuzzer.output_domain(os.path.join(
+                    outFileDir, "domain.pddl"), canonical)
+            fuzzer.output_operations(os.path.join(
+                    outFileDir, "fuzz_ops.txt"))
+        except Exception as err:
+            msg = "{} - {} - {}".format(
+                    domainFile, rate, repr(err))
+            failed.append(outFileDir)
+            errors.append(msg)
+    return failed, errors
+
+
+# the generator of a worker process, inherited from
+# the parent instead of being sent along with every job
+_worker = None
+
+
+def _initWorker(generator : "Generator") -> None:
+    global _worker
+    _worker = generator
+
+
+def generateDomain(
+        instance : Tuple[str, str, List[str]]
+        ) -> Tuple[list, dict, int, int, int]:
+    """Lay out the output directories of one domain and fuzz
+    it (or, with --inProcess, plan its mutants) in a worker.
+
+    Returns the tasks to solve, the deferred mutants, and the
+    numbers of mutants, of failed and of skipped ones."""
+    generator = _worker
+    generator._tasks = list()
+    generator._mutants = dict()
+    generator._numMutants = 0
+    generator._numFailed = 0
+    generator._numSkipped = 0
+    generator._run(instance)
+    return (generator._tasks, generator._mutants,
+            generator._numMutants, generator._numFailed,
+            generator._numSkipped)
+
+
+def solveTask(
+        task : Tuple[str, str, str, int]
+        ) -> Tuple[Tuple[str, str, str, int], int]:
+    return _worker._solve(task)
+
+
 class Generator:
     def __init__(
             self, 
@@ -60,6 +136,33 @@ class Generator:
             self._instances.append(
                     (domain, domainFile, taskFiles))
         self._tasks = list()
+        self._mutants = dict()
+        self._numMutants = 0
+        self._numFailed = 0
+        self._numSkipped = 0
+        self._manifest = None
+        self._solver = None
+        fuzzerDir = os.path.dirname(
+                os.path.abspath(self._pathFuzzer()))
+        if fuzzerDir not in sys.path:
+            sys.path.insert(0, fuzzerDir)
+        if self._args.manifest is not None:
+            from manifest import Manifest
+            self._manifest = Manifest(self._args.manifest)
+        if self._args.solve:
+            import runner
+            from manifest import planner_id
+            planCache = None
+            if self._args.planCache is not None:
+                from plan_cache import PlanCache
+                planCache = PlanCache(
+                        self._args.planCache)
+            self._solver = runner.Solver(
+                    [sys.executable, self._args.downward],
+                    planner_id(self._args.downward),
+                    self._resultsTable(), self._manifest,
+                    planCache, self._args.memoryLimit,
+                    self._args.cpuLimit)
 
     def _copyTasks(
             self, 
@@ -80,6 +183,118 @@ class Generator:
                     type(err))
             self._logger.error(msg)
 
+    def _pathFuzzer(self) -> str:
+        pathFuzzer = "../fuzzer.py"
+        if self._args.fuzzer is not None:
+            pathFuzzer = self._args.fuzzer
+        return pathFuzzer
+
+    def _digest(
+            self,
+            paths : List[str],
+            *extra : Any) -> str:
+        from manifest import digest
+        return digest(paths, *extra)
+
+    def _fuzzed(
+            self,
+            domainFile : str,
+            rate : float,
+            outFileDir : str) -> bool:
+        key = self._digest(
+                [domainFile], rate, self._args.canonical)
+        entry = self._manifest.lookup(
+                "mutant", outFileDir, key)
+        if entry is None:
+            return False
+        for name in ("domain.pddl", "fuzz_ops.txt"):
+            if not os.path.isfile(os.path.join(
+                    outFileDir, name)):
+                return False
+        return True
+
+    def _recordFuzzed(
+            self,
+            domainFile : str,
+            rate : float,
+            outFileDir : str) -> None:
+        key = self._digest(
+                [domainFile], rate, self._args.canonical)
+        self._manifest.record(
+                "mutant", outFileDir, key)
+
+    def _fuzz(
+            self,
+            domainFile : str,
+            rate : float,
+            outFileDir : str) -> None:
+        self._numMutants += 1
+        if (self._manifest is not None and
+                self._fuzzed(domainFile, rate, outFileDir)):
+            self._numSkipped += 1
+            return
+        if self._args.inProcess:
+            # defer to _fuzzInProcess so that every
+            # domain is parsed once for all its mutants
+            targets = self._mutants.setdefault(
+                    domainFile, [])
+            targets.append((rate, outFileDir))
+            return
+        cmd = [sys.executable, 
+               self._pathFuzzer(),
+               "--rate",
+               str(rate),
+               "--domain",
+               domainFile,
+               "--outDomain",
+               outFileDir,
+               "--outOperations",
+               outFileDir]
+        if self._args.canonical:
+            cmd.append("--canonical")
+        proc = subprocess.run(
+            cmd, capture_output=True)
+        try:
+            proc.check_returncode()
+        except CalledProcessError as err:
+            msg = "{} - {}".format(
+                    err.cmd, err.output)
+            self._logger.error(msg)
+            self._numFailed += 1
+            return
+        if self._manifest is not None:
+            self._recordFuzzed(domainFile, rate, outFileDir)
+
+    def _fuzzInProcess(self) -> None:
+        fuzzerDir = os.path.dirname(
+                os.path.abspath(self._pathFuzzer()))
+        jobs = [(fuzzerDir, domainFile, targets,
+                 self._args.canonical)
+                for domainFile, targets
+                in self._mutants.items()]
+        allFailed = set()
+        with multiprocessing.Pool(self._numCPUs()) as p:
+            for failed, errors in tqdm(
+                    p.imap_unordered(fuzzDomain, jobs),
+                    total=len(jobs)):
+                self._numFailed += len(failed)
+                allFailed.update(failed)
+                for msg in errors:
+                    self._logger.error(msg)
+        if self._manifest is not None:
+            for domainFile, targets in self._mutants.items():
+                for rate, outFileDir in targets:
+                    if outFileDir not in allFailed:
+                        self._recordFuzzed(
+                                domainFile, rate, outFileDir)
+        self._mutants = dict()
+
+    def _numCPUs(self) -> int:
+        numCPUs = multiprocessing.cpu_count()
+        if self._args.numCPUs is not None:
+            numCPUs = self._args.numCPUs
+        return numCPUs
+
     def _single(
             self, 
             instance : Tuple[str, str, List[str]]) -> None:
@@ -101,29 +316,9 @@ class Generator:
                         outTaskDir, outFileDir)
                 if not os.path.exists(outFileDir):
                     os.mkdir(outFileDir)
-                pathFuzzer = "../fuzzer.py"
-                if self._args.fuzzer is not None:
-                    pathFuzzer = self._args.fuzzer
-                cmd = [sys.executable, 
-                       pathFuzzer,
-                       "--rate",
-                       str(rate),
-                       "--domain",
-                       domainFile,
-                       "--outDomain",
-                       outFileDir,
-                       "--outOperations",
-                       outFileDir]
-                proc = subprocess.run(
-                    cmd, capture_output=True)
-                try:
-                    proc.check_returncode()
-                except CalledProcessError as err:
-                    msg = "{} - {}".format(
-                            err.cmd, err.output)
-                    self._logger.error(msg)
+                self._fuzz(domainFile, rate, outFileDir)
             self._tasks.append(
-                    (domainFile, taskFile, outTaskDir))
+                    (domainFile, taskFile, outTaskDir, None))
 
     def _batch(
             self, 
@@ -137,27 +332,7 @@ class Generator:
                     outDomainDir, outFileDir)
             if not os.path.exists(outFileDir):
                 os.mkdir(outFileDir)
-            pathFuzzer = "../fuzzer.py"
-            if self._args.fuzzer is not None:
-                    pathFuzzer = self._args.fuzzer
-            cmd = [sys.executable, 
-                    pathFuzzer,
-                    "--rate",
-                    str(rate),
-                    "--domain",
-                    domainFile,
-                    "--outDomain",
-                    outFileDir,
-                    "--outOperations",
-                    outFileDir]
-            proc = subprocess.run(
-                    cmd, capture_output=True)
-            try:
-                proc.check_returncode()
-            except CalledProcessError as err:
-                msg = "{} - {}".format(
-                        err.cmd, err.output)
-                self._logger.error(msg)
+            self._fuzz(domainFile, rate, outFileDir)
         for taskFile in taskFiles:
             taskName = os.path.basename(taskFile)
             taskName = taskName.split(".")[0]
@@ -168,7 +343,7 @@ class Generator:
                 os.mkdir(outTaskDir)
             self._copyTasks(outTaskDir, taskFile)
             self._tasks.append(
-                    (domainFile, taskFile, outTaskDir))
+                    (domainFile, taskFile, outTaskDir, None))
 
     def _run(
             self, 
@@ -185,34 +360,85 @@ class Generator:
 
     def _solve(
             self, 
-            task : Tuple[str, str, str]) -> bool:
-        domainFile, taskFile, outDir = task
+            task : Tuple[str, str, str, int]
+            ) -> Tuple[Tuple[str, str, str, int], int]:
+        """Returns the task along with the exit
+        code of the planner."""
+        domainFile, taskFile, outDir, timeLimit = task
         planFile = os.path.join(
                 outDir, "sas_plan")
         sasFile = os.path.join(
                 outDir, "output.sas")
-        cmd = [sys.executable, 
-               self._args.downward, 
-               "--alias", 
-               "lama-first", 
-               "--overall-time-limit", 
-               "900", 
-               "--plan-file", 
-               planFile, 
-               "--sas-file",
-               sasFile,
-               domainFile, 
-               taskFile]
-        proc = subprocess.run(
-                cmd, capture_output=True)
-        try:
-            proc.check_returncode()
-        except CalledProcessError as err:
-            msg = "{} - {}".format(
-                    err.cmd, err.output)
+        returncode = self._solver.solve(
+                domainFile, taskFile, outDir,
+                planFile, sasFile, timeLimit,
+                self._logRun)
+        return task, returncode
+
+    def _logRun(
+            self,
+            cmd : List[str],
+            result : Any) -> None:
+        if result.returncode != 0:
+            msg = "{} - {} - {}".format(
+                    cmd, result.returncode, result.stdout)
             self._logger.error(msg)
-            return False
-        return True
+
+    def _resultsTable(self) -> str:
+        if self._args.results is not None:
+            return self._args.results
+        return os.path.join(self._args.out, "results.csv")
+
+    def _solveAll(self, numCPUs : int) -> None:
+        """Run every task with a short time limit first,
+        then the ones that timed out with growing limits,
+        the longest expected ones first."""
+        import runner
+        from schedule import (
+                TIMEOUT, seconds, time_limits,
+                history, longest_first)
+        runner.open_table(self._resultsTable())
+        limits = time_limits(
+                seconds(self._args.initialTimeLimit),
+                seconds(self._args.timeLimit),
+                self._args.timeLimitFactor)
+        times = dict()
+        if self._manifest is not None:
+            times = history(
+                    self._manifest.entries("solve"))
+        tasks = self._tasks
+        for timeLimit in limits:
+            if not tasks:
+                break
+            print("- Solving {} tasks with a time "
+                  "limit of {}s".format(
+                    len(tasks), timeLimit))
+            tasks = longest_first(
+                    tasks, times, key=lambda t : t[2])
+            tasks = [(domainFile, taskFile, outDir, timeLimit)
+                     for domainFile, taskFile, outDir, _
+                     in tasks]
+            # tasks are sent as small tuples, in chunks,
+            # and collected as soon as any of them is done
+            chunksize = max(1, min(
+                    16, len(tasks) // (4 * numCPUs)))
+            timeouts = []
+            startTime = time.perf_counter()
+            with multiprocessing.Pool(
+                    numCPUs, initializer=_initWorker,
+                    initargs=(self,)) as p:
+                for task, returncode in tqdm(
+                        p.imap_unordered(
+                            solveTask, tasks, chunksize),
+                        total=len(tasks)):
+                    if returncode == TIMEOUT:
+                        timeouts.append(task)
+            elapsed = time.perf_counter() - startTime
+            print("- Solved {} tasks in {:.2f}s "
+                  "({:.2f} tasks/s)".format(
+                    len(tasks), elapsed,
+                    len(tasks) / max(elapsed, 1e-9)))
+            tasks = timeouts
 
     def start(self) -> None:
         print("- Generating corrupted domains")
@@ -220,21 +446,42 @@ class Generator:
             print("- Each domain is paried with one task")
         if self._args.multiple:
             print("- Each domain is paired with multiple tasks")
-        for instance in tqdm(self._instances):
-            self._run(instance)
+        startTime = time.perf_counter()
+        with multiprocessing.Pool(
+                self._numCPUs(), initializer=_initWorker,
+                initargs=(self,)) as p:
+            for result in tqdm(
+                    p.imap_unordered(
+                        generateDomain, self._instances),
+                    total=len(self._instances)):
+                (tasks, mutants, numMutants,
+                 numFailed, numSkipped) = result
+                self._tasks.extend(tasks)
+                self._mutants.update(mutants)
+                self._numMutants += numMutants
+                self._numFailed += numFailed
+                self._numSkipped += numSkipped
+        if self._args.inProcess:
+            self._fuzzInProcess()
+        elapsed = time.perf_counter() - startTime
+        numFuzzed = (self._numMutants - self._numFailed
+                     - self._numSkipped)
+        print("- Fuzzed {} of {} mutants in {:.2f}s "
+              "({:.1f} mutants/s)".format(
+                numFuzzed, self._numMutants, elapsed,
+                numFuzzed / max(elapsed, 1e-9)))
+        if self._numSkipped:
+            print("- Skipped {} mutants fuzzed by an "
+                  "earlier run".format(self._numSkipped))
         if not self._args.solve:
             return
         assert(self._args.downward is not None)
         print("- Solving the planning tasks")
-        numCPUs = multiprocessing.cpu_count()
         print("- Num avaliable CPUs: {}".format(
-                numCPUs))
-        if self._args.numCPUs is not None:
-            numCPUs = self._args.numCPUs
+                multiprocessing.cpu_count()))
+        numCPUs = self._numCPUs()
         print("- Using {} CPUs".format(numCPUs))
-        with multiprocessing.Pool(numCPUs) as p:
-            _ = list(tqdm(p.imap(self._solve, self._tasks), 
-                          total=len(self._tasks)))
+        self._solveAll(numCPUs)
         print("- Done!")
 
 if __name__ == "__main__":
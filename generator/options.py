@@ -22,6 +22,26 @@ def setup():
     parser.add_argument(
             "--fuzzer", type=str,
             help="path to the fuzzer")
+    parser.add_argument(
+            "--inProcess", action="store_true",
+            default=False,
+            help=("fuzz the domains in a pool of "
+                  "worker processes, parsing each "
+                  "domain once, instead of calling "
+                  "the fuzzer once per error rate"))
+    parser.add_argument(
+            "--manifest", type=str,
+            help=("append-only log of the fuzzed "
+                  "domains and solved tasks; a rerun "
+                  "with the same manifest skips the "
+                  "work it records as done with "
+                  "unchanged inputs"))
+    parser.add_argument(
+            "--canonical", action="store_true",
+            default=False,
+            help=("write the fuzzed domains with their "
+                  "declarations sorted, so that equal "
+                  "mutants are byte-identical"))
     parser.add_argument(
             "--benchmarks", required=True,
             help="the directory of the benchmarks")
@@ -39,4 +59,37 @@ def setup():
     parser.add_argument(
             "--downward", type=str,
             help="path to Fast-downward")
+    parser.add_argument(
+            "--planCache", type=str,
+            help=("directory of the store of planner "
+                  "results; identical tasks reuse the "
+                  "plan and exit code instead of "
+                  "running the planner"))
+    parser.add_argument(
+            "--memoryLimit", type=int,
+            help=("address space limit of "
+                  "Fast-downward in MB"))
+    parser.add_argument(
+            "--cpuLimit", type=int,
+            help=("cpu time limit of each Fast-downward "
+                  "process in seconds"))
+    parser.add_argument(
+            "--results", type=str,
+            help=("table of the exit code, wall and "
+                  "cpu time and peak memory of every "
+                  "planner run (default: results.csv "
+                  "in the output directory)"))
+    parser.add_argument(
+            "--timeLimit", type=str, default="900",
+            help="time limit for running Fast-downward")
+    parser.add_argument(
+            "--initialTimeLimit", type=str, default="60",
+            help=("time limit of the first attempt "
+                  "to solve a task; the tasks reaching "
+                  "it are solved again with growing "
+                  "limits, up to --timeLimit"))
+    parser.add_argument(
+            "--timeLimitFactor", type=float, default=4.0,
+            help=("growth of the time limit between "
+                  "two attempts"))
     return parser.parse_args()
\ No newline at end of file
@@ -0,0 +1,220 @@
+import os
+import csv
+import argparse
+import multiprocessing
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from schedule import TIMEOUT
+
+# exit code of fast-downward when the task is proven unsolvable
+UNSOLVABLE = 12
+
+PLAN_FILES = ("plan", "sas_plan")
+INSTANCE_FILES = PLAN_FILES + ("output.sas", "task.pddl")
+
+FIELDS = [
+    "instance", "domain", "task", "list", "outcome",
+    "returncode", "time_limit", "wall", "maxrss",
+    "plan_length", "cost", "cost_type",
+    "sas_version", "metric", "variables"]
+
+
+def find_instances(root: str) -> Iterator[str]:
+    """The directories below root holding a task or a plan:
+    the white-list and black-list instances written by main.py,
+    or the task directories written by generator.py."""
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+        names = set()
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            else:
+                names.add(entry.name)
+        if any(name in names for name in INSTANCE_FILES):
+            yield path
+
+
+def read_plan(path: str) -> Tuple[int, Optional[int], str]:
+    """The length, cost and cost type of a plan file."""
+    length = 0
+    cost = None
+    cost_type = ""
+    with open(path) as f:
+        for line in f:
+            if line.startswith("("):
+                length += 1
+            elif line.startswith("; cost = "):
+                # "; cost = 12 (unit cost)"
+                fields = line[len("; cost = "):].split(None, 1)
+                cost = int(fields[0])
+                if len(fields) > 1:
+                    cost_type = fields[1].strip().strip("()")
+    return length, cost, cost_type
+
+
+def read_sas_header(path: str) -> Tuple[str, str, str]:
+    """The version, metric and number of variables of an
+    output.sas file, read from its first lines only."""
+    lines = []
+    with open(path) as f:
+        for line in f:
+            lines.append(line.strip())
+            if len(lines) == 7:
+                break
+    if (len(lines) < 7 or lines[0] != "begin_version"
+            or lines[3] != "begin_metric"):
+        return "", "", ""
+    return lines[1], lines[4], lines[6]
+
+
+def outcome(kind: str, solved: bool, returncode: Optional[int]) -> str:
+    """Classifies the run of an instance. A plan of a white-list
+    or black-list instance distinguishes the two domains it was
+    compiled from: a plan of one that the other rejects. A loose
+    white-list instance is the original task, whose plan does not
+    distinguish anything.
+
+    The recorded exit code comes first: a plan only counts if the
+    run that produced it succeeded, since a plan file left by an
+    earlier run may not belong to the recorded one. Without a
+    recorded run, the plan files are all there is to go by."""
+    compiled = kind in ("white-list", "black-list")
+    if returncode is None and not solved:
+        return "not-run"
+    if returncode is None or returncode == 0:
+        if solved:
+            return "distinguished" if compiled else "solved"
+        return "error"
+    if returncode == UNSOLVABLE:
+        return "indistinguishable" if compiled else "unsolvable"
+    if returncode == TIMEOUT:
+        return "timeout"
+    return "error"
+
+
+def harvest_instance(
+        job: Tuple[str, str, Optional[Dict[str, str]], bool]
+        ) -> Dict[str, Any]:
+    path, root, run, loose = job
+    parts = os.path.relpath(path, root).split(os.sep)
+    kind = ""
+    if parts[-1] in ("white-list", "black-list"):
+        kind = parts.pop()
+        if loose and kind == "white-list":
+            kind = "loose-white-list"
+    row = dict.fromkeys(FIELDS, "")
+    row["instance"] = path
+    row["domain"] = parts[0] if parts else ""
+    row["task"] = parts[-1] if len(parts) > 1 else ""
+    row["list"] = kind
+    returncode = None
+    if run is not None:
+        returncode = int(run["returncode"])
+        for field in ("returncode", "time_limit", "wall", "maxrss"):
+            row[field] = run[field]
+    solved = False
+    # after a failed run, a plan file is left by an earlier one
+    plans = PLAN_FILES if returncode in (None, 0) else ()
+    for name in plans:
+        plan_file = os.path.join(path, name)
+        if os.path.isfile(plan_file):
+            length, cost, cost_type = read_plan(plan_file)
+            row["plan_length"] = length
+            row["cost"] = "" if cost is None else cost
+            row["cost_type"] = cost_type
+            solved = True
+            break
+    sas_file = os.path.join(path, "output.sas")
+    if os.path.isfile(sas_file):
+        version, metric, variables = read_sas_header(sas_file)
+        row["sas_version"] = version
+        row["metric"] = metric
+        row["variables"] = variables
+    row["outcome"] = outcome(kind, solved, returncode)
+    return row
+
+
+def read_runs(path: Optional[str]) -> Dict[str, Dict[str, str]]:
+    """The last run of every instance in a results table
+    written by runner.record, if there is one."""
+    runs = dict()
+    if path is None or not os.path.isfile(path):
+        return runs
+    with open(path, newline="") as f:
+        for run in csv.DictReader(f):
+            runs[os.path.normpath(run["name"])] = run
+    return runs
+
+
+def harvest(
+        root: str,
+        out_file: str,
+        results: Optional[str] = None,
+        instances: Optional[Iterable[str]] = None,
+        num_cpus: Optional[int] = None,
+        loose: bool = False) -> int:
+    """Write one row per instance below root to out_file, and
+    return the number of rows. The instances are found below
+    root unless given; the files are read on a process pool.
+    With loose, the white-list instances are the original tasks
+    of main.py --loose_white_list."""
+    runs = read_runs(results)
+    if instances is None:
+        instances = list(find_instances(root))
+        # tasks that were run without leaving any file
+        found = set(os.path.normpath(path) for path in instances)
+        instances += [path for path in runs
+                      if path not in found and os.path.isdir(path)]
+    jobs = [(path, root, runs.get(os.path.normpath(path)), loose)
+            for path in instances]
+    if num_cpus is None:
+        num_cpus = multiprocessing.cpu_count()
+    # small jobs: send them in large chunks
+    chunksize = max(1, len(jobs) // (8 * num_cpus))
+    with open(out_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        if num_cpus == 1 or len(jobs) < 2 * chunksize:
+            writer.writerows(map(harvest_instance, jobs))
+        else:
+            with multiprocessing.Pool(num_cpus) as p:
+                writer.writerows(
+                    p.imap(harvest_instance, jobs, chunksize))
+    return len(jobs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="collect the plans of solved instances into a table")
+    parser.add_argument(
+        "--output", type=str, required=True,
+        help="output directory of main.py or generator.py")
+    parser.add_argument(
+        "--results", type=str,
+        help=("table of the planner runs "
+              "(default: results.csv in the output directory)"))
+    parser.add_argument(
+        "--out", type=str,
+        help="table to write (default: harvest.csv in the output directory)")
+    parser.add_argument(
+        "--num_cpus", type=int,
+        help="number of cpus used")
+    parser.add_argument(
+        "--loose_white_list", action="store_true",
+        help="the instances were prepared with main.py --loose_white_list")
+    args = parser.parse_args()
+    results = args.results
+    if results is None:
+        results = os.path.join(args.output, "results.csv")
+    out_file = args.out
+    if out_file is None:
+        out_file = os.path.join(args.output, "harvest.csv")
+    num_rows = harvest(args.output, out_file, results,
+                       num_cpus=args.num_cpus, loose=args.loose_white_list)
+    print("{} instances written to {}".format(num_rows, out_file))
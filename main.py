@@ -1,20 +1,21 @@
 from fuzzer import *
 from transformer import *
 from tqdm import tqdm
+import runner
+from staging import Stager
+from harvest import harvest
+from plan_cache import PlanCache
+from manifest import Manifest, digest, planner_id
+from schedule import (
+    TIMEOUT, seconds, time_limits, history, longest_first)
+from fd.pddl import parse_cache
 
 import os
 import logging
+import queue
 import argparse
-import subprocess
 import multiprocessing
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s %(levelname)-8s %(message)s",
-    datefmt="%m-%d %H:%M",
-    filename="log",
-    filemode="w")
-
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "--input", type=str,
@@ -34,6 +35,30 @@ parser.add_argument(
 parser.add_argument(
     "--time_limit", type=str, default="120",
     help="time limit for running fast-downward")
+parser.add_argument(
+    "--initial_time_limit", type=str, default="10",
+    help=("time limit of the first attempt to solve an instance; "
+          "the instances reaching it are solved again with growing "
+          "limits, up to --time_limit"))
+parser.add_argument(
+    "--time_limit_factor", type=float, default=4.0,
+    help="growth of the time limit between two attempts")
+parser.add_argument(
+    "--memory_limit", type=int,
+    help=("address space limit of fast-downward in MB; "
+          "a run exceeding it fails instead of swapping"))
+parser.add_argument(
+    "--cpu_limit", type=int,
+    help="cpu time limit of each fast-downward process in seconds")
+parser.add_argument(
+    "--results", type=str,
+    help=("table of the exit code, wall and cpu time and peak "
+          "memory of every planner run (default: results.csv "
+          "in the output directory)"))
+parser.add_argument(
+    "--harvest", type=str,
+    help=("table of the plans and outcomes of the instances, written "
+          "after solving (default: harvest.csv in the output directory)"))
 parser.add_argument(
     "--num_cpus", type=int,
     help="number of cpus used")
@@ -43,149 +68,485 @@ parser.add_argument(
 parser.add_argument(
     "--solve", action="store_true",
     default=False, help="call fast-downward to find plans")
+parser.add_argument(
+    "--producers", type=int,
+    help=("number of the cpus preparing instances while the others "
+          "solve them, with --solve (default: a quarter of the cpus)"))
+parser.add_argument(
+    "--queue_size", type=int,
+    help=("maximal number of prepared instances waiting to be solved, "
+          "with --solve (default: twice the number of cpus)"))
+parser.add_argument(
+    "--manifest", type=str,
+    help=("append-only log of the prepared and solved instances; "
+          "a rerun with the same manifest skips the domains and "
+          "instances it records as done with unchanged inputs"))
+parser.add_argument(
+    "--plan_cache", type=str,
+    help=("directory of the store of planner results, keyed by the "
+          "contents of the domain and task files; identical instances "
+          "reuse the plan and exit code instead of running the planner"))
+parser.add_argument(
+    "--canonical", action="store_true",
+    help=("write the modified domains and the compiled instances with "
+          "their declarations sorted, so that equal instances are "
+          "byte-identical and share the entries of the plan cache"))
+parser.add_argument(
+    "--cache_dir", type=str,
+    help="directory of the on-disk cache of parsed PDDL files")
+parser.add_argument(
+    "--cache_size", type=int, default=1024,
+    help="size bound of the parse cache in MB")
 args = parser.parse_args()
+stager = Stager()
+# set before the workers are forked
+manifest = None
+results_table = None
+solver = None
 
 
-def exec_cmd(cmd):
-    proc = subprocess.run(cmd, capture_output=True)
-    if proc.returncode != 0:
-        if cmd[0] == "cp":
-            logging.error(str(proc.stderr))
-        elif cmd[0] == args.downward:
-            if proc.returncode == 23:
-                msg = "Reaching time limit: {task_file}".format(
-                    task_file=cmd[-1])
-                logging.info(msg)
-            elif proc.returncode == 12:
-                msg = "No solutions found: {task_file}".format(
-                    task_file=cmd[-1])
-                logging.warning(msg)
-            else:
-                msg = "Error for solving the task: {task_file} -- {err_msg}".format(
-                    task_file=cmd[-1],
-                    err_msg=str(proc.stderr))
-                logging.error(msg)
-        else:
-            logging.error(str(proc.stderr))
+def stage_copy(src, dst):
+    try:
+        stager.copy(src, dst)
+    except OSError as e:
+        logging.error(str(e))
+
 
+def log_run(cmd, result):
+    task_file = cmd[-1]
+    if result.returncode == TIMEOUT:
+        msg = "Reaching time limit: {task_file}".format(
+            task_file=task_file)
+        logging.info(msg)
+    elif result.returncode == 12:
+        msg = "No solutions found: {task_file}".format(
+            task_file=task_file)
+        logging.warning(msg)
+    elif result.returncode != 0:
+        msg = "Error for solving the task: {task_file} -- {err_msg}".format(
+            task_file=task_file,
+            err_msg=str(result.stderr))
+        logging.error(msg)
 
-def solve(outdir):
+
+def solve(outdir, time_limit):
+    """Run fast-downward on the instance with the time limit
+    in seconds, unless the manifest records a run that makes
+    this one useless or the plan cache has the result of an
+    identical instance. Returns the exit code of the planner."""
     domain_file = os.path.join(outdir, "domain.pddl")
     task_file = os.path.join(outdir, "task.pddl")
     plan_file = os.path.join(outdir, "plan")
     sas_file = os.path.join(outdir, "output.sas")
-    cmd = [
-        args.downward,
-        "--overall-time-limit",
-        args.time_limit,
-        "--plan-file",
-        plan_file,
-        "--sas-file",
-        sas_file,
-        "--alias",
-        "lama-first",
-        domain_file,
-        task_file]
-    exec_cmd(cmd)
+    return solver.solve(
+        domain_file, task_file, outdir, plan_file, sas_file,
+        time_limit, log_run)
 
 
-if __name__ == '__main__':
-    instances = []
-    for domain in os.listdir(args.input):
-        domain_dir = os.path.join(args.input, domain)
-        if not os.path.isdir(domain_dir):
-            continue
-        if "domain.pddl" not in os.listdir(domain_dir):
-            continue
-        domain_file = os.path.join(domain_dir, "domain.pddl")
-        domain_outdir = os.path.join(args.output, domain)
-        if not os.path.exists(domain_outdir):
-            os.mkdir(domain_outdir)
-        domain_outfile = os.path.join(domain_outdir, "domain.pddl")
-        cmd = ["cp", domain_file, domain_outfile]
-        exec_cmd(cmd)
-        modified_outfile = os.path.join(domain_outdir, "domain-modified.pddl")
-        if args.relax is None and args.harden is None:
-            if "domain-modified.pddl" not in os.listdir(domain_dir):
-                continue
-            modified_file = os.path.join(domain_dir, "domain-modified.pddl")
-            cmd = ["cp", modified_file, modified_outfile]
-            exec_cmd(cmd)
+def domain_key(domain):
+    """The digest of the input files of the domain
+    and of the options used to prepare it."""
+    domain_dir = os.path.join(args.input, domain)
+    files = sorted(
+        os.path.join(domain_dir, name)
+        for name in os.listdir(domain_dir)
+        if os.path.isfile(os.path.join(domain_dir, name)))
+    names = [os.path.basename(path) for path in files]
+    return digest(
+        files, names, args.relax, args.harden, args.loose_white_list,
+        args.canonical)
+
+
+def prepared(domain, key):
+    """The instances of the domain recorded by the
+    manifest, or None if they must be prepared again."""
+    entry = manifest.lookup("domain", domain, key)
+    if entry is None:
+        return None
+    for outdir in entry["instances"]:
+        for name in ("domain.pddl", "task.pddl"):
+            if not os.path.isfile(os.path.join(outdir, name)):
+                return None
+    return entry["instances"]
+
+
+def prepare(domain):
+    """Fuzz and transform the domain, and return its instances: none
+    if the domain is skipped, or None if preparing it failed, which
+    may not happen again on a rerun."""
+    domain_dir = os.path.join(args.input, domain)
+    if not os.path.isdir(domain_dir):
+        return []
+    if "domain.pddl" not in os.listdir(domain_dir):
+        return []
+    domain_file = os.path.join(domain_dir, "domain.pddl")
+    domain_outdir = os.path.join(args.output, domain)
+    stager.makedirs(domain_outdir)
+    domain_outfile = os.path.join(domain_outdir, "domain.pddl")
+    stage_copy(domain_file, domain_outfile)
+    modified_outfile = os.path.join(domain_outdir, "domain-modified.pddl")
+    if args.relax is None and args.harden is None:
+        if "domain-modified.pddl" not in os.listdir(domain_dir):
+            return []
+        modified_file = os.path.join(domain_dir, "domain-modified.pddl")
+        stage_copy(modified_file, modified_outfile)
+    else:
+        relax_rate = args.relax if args.relax is not None else 0.0
+        harden_rate = args.harden if args.harden is not None else 0.0
+        try:
+            fuzzer = Fuzzer(harden_rate, relax_rate, domain_file)
+            stager.release(modified_outfile)
+            fuzzer.output_domain(modified_outfile, args.canonical)
+            ops_outfile = os.path.join(domain_outdir, "flaws")
+            fuzzer.output_operations(ops_outfile)
+        except InvalidDomainError as e:
+            logging.info(e)
+            stager.remove(domain_outdir)
+            return []
+        except Exception as e:
+            logging.error(str(e) + ":" + str(domain))
+            stager.remove(domain_outdir)
+            return None
+    task_names = filter(lambda x: "domain" not in x, os.listdir(domain_dir))
+    invalid = False
+    tasks = []
+    # the compiled domains only depend on the domain pair,
+    # so each direction is compiled once for all the tasks,
+    # and both directions share one parse of each domain
+    try:
+        original = Domain(domain_outfile)
+        modified = Domain(modified_outfile)
+        pos_transformer = None
+        if not args.loose_white_list:
+            pos_transformer = Transformer(
+                original, modified, args.canonical)
+        neg_transformer = Transformer(
+            modified, original, args.canonical)
+    except Exception as e:
+        logging.error(str(e) + ":" + str(domain))
+        stager.remove(domain_outdir)
+        return None
+    for task_name in task_names:
+        task_file = os.path.join(domain_dir, task_name)
+        task_outdir = os.path.join(domain_outdir, task_name.replace(".pddl", ""))
+        pos_dir = os.path.join(task_outdir, "white-list")
+        neg_dir = os.path.join(task_outdir, "black-list")
+        stager.makedirs(pos_dir, neg_dir)
+        task_outfile = os.path.join(task_outdir, task_name)
+        stage_copy(task_file, task_outfile)
+        # the transformer rewrites these files in place, so they
+        # must not stay hard links to staged copies of earlier runs
+        pos_files = [os.path.join(pos_dir, "domain.pddl"),
+                     os.path.join(pos_dir, "task.pddl")]
+        neg_files = [os.path.join(neg_dir, "domain.pddl"),
+                     os.path.join(neg_dir, "task.pddl")]
+        if args.loose_white_list:
+            # if we do not harden the problem
+            # we then relax the definition of positive plans
+            # such that a positive plan only need to be a
+            # solution to the ground truth problem
+            stage_copy(domain_outfile, pos_files[0])
+            stage_copy(task_outfile, pos_files[1])
         else:
-            relax_rate = args.relax if args.relax is not None else 0.0
-            harden_rate = args.harden if args.harden is not None else 0.0
-            try:
-                fuzzer = Fuzzer(harden_rate, relax_rate, domain_file)
-                fuzzer.output_domain(modified_outfile)
-                ops_outfile = os.path.join(domain_outdir, "flaws")
-                fuzzer.output_operations(ops_outfile)
-            except InvalidDomainError as e:
-                logging.info(e)
-                cmd = ["rm", "-rf", domain_outdir]
-                exec_cmd(cmd)
-                continue
-            except Exception as e:
-                logging.error(str(e) + ":" + str(domain))
-                cmd = ["rm", "-rf", domain_outdir]
-                exec_cmd(cmd)
-                continue
-        task_names = filter(lambda x: "domain" not in x, os.listdir(domain_dir))
-        invalid = False
-        tasks = []
-        for task_name in task_names:
-            task_file = os.path.join(domain_dir, task_name)
-            task_outdir = os.path.join(domain_outdir, task_name.replace(".pddl", ""))
-            if not os.path.exists(task_outdir):
-                os.mkdir(task_outdir)
-            task_outfile = os.path.join(task_outdir, task_name)
-            cmd = ["cp", task_file, task_outfile]
-            exec_cmd(cmd)
-            pos_dir = os.path.join(task_outdir, "white-list")
-            if not os.path.exists(pos_dir):
-                os.mkdir(pos_dir)
-            neg_dir = os.path.join(task_outdir, "black-list")
-            if not os.path.exists(neg_dir):
-                os.mkdir(neg_dir)
-            if args.loose_white_list:
-                # if we do not harden the problem
-                # we then relax the definition of positive plans
-                # such that a positive plan only need to be a
-                # solution to the ground truth problem
-                domain_tempfile = os.path.join(pos_dir, "domain.pddl")
-                cmd = ["cp", domain_outfile, domain_tempfile]
-                exec_cmd(cmd)
-                task_tempfile = os.path.join(pos_dir, "task.pddl")
-                cmd = ["cp", task_outfile, task_tempfile]
-                exec_cmd(cmd)
-            else:
-                try:
-                    dx, dy = Domain(domain_outfile), Domain(modified_outfile)
-                    t = Transformer(dx, dy)
-                    t.output_domain(pos_dir)
-                    t.output_task(task_outfile, pos_dir)
-                except Exception as e:
-                    logging.error(str(e) + ":" + str(domain))
-                    invalid = True
-                    break
-            tasks.append(pos_dir)
             try:
-                dx, dy = Domain(modified_outfile), Domain(domain_outfile)
-                t = Transformer(dx, dy)
-                t.output_domain(neg_dir)
-                t.output_task(task_outfile, neg_dir)
+                for path in pos_files:
+                    stager.release(path)
+                pos_transformer.output_domain(pos_dir)
+                pos_transformer.output_task(task_outfile, pos_dir)
             except Exception as e:
                 logging.error(str(e) + ":" + str(domain))
                 invalid = True
                 break
-            tasks.append(neg_dir)
-        if invalid:
-            cmd = ["rm", "-rf", domain_outdir]
-            exec_cmd(cmd)
-        else:
-            instances += tasks
-    if args.solve:
-        num_cpus = multiprocessing.cpu_count()
-        if args.num_cpus is not None:
-            num_cpus = args.num_cpus
+        tasks.append(pos_dir)
+        try:
+            for path in neg_files:
+                stager.release(path)
+            neg_transformer.output_domain(neg_dir)
+            neg_transformer.output_task(task_outfile, neg_dir)
+        except Exception as e:
+            logging.error(str(e) + ":" + str(domain))
+            invalid = True
+            break
+        tasks.append(neg_dir)
+    if invalid:
+        stager.remove(domain_outdir)
+        return None
+    return tasks
+
+
+class LogRecords(logging.Handler):
+    """Keeps what a worker logs, to be logged by the parent."""
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+
+records = LogRecords()
+
+
+def init_worker():
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(records)
+    root.setLevel(logging.DEBUG)
+    if args.cache_dir is not None and parse_cache.current is None:
+        parse_cache.configure(
+            args.cache_dir, args.cache_size * 1024 * 1024)
+
+
+def prepare_domain(domain, emit=None):
+    """Fuzz and transform one domain in a worker. Returns the
+    white-list and black-list instances of its tasks (none if the
+    domain is skipped or invalid), the messages to log, the staging
+    counts and the parse cache statistics of this domain.
+
+    If given, emit is called with each instance once the whole
+    domain is prepared: a domain found invalid at a later task is
+    removed, and its instances must not be solved meanwhile."""
+    global stager
+    stager = Stager()
+    records.records = []
+    cache = parse_cache.current
+    cache_stats = cache.stats() if cache is not None else None
+    try:
+        key = None
+        if manifest is not None:
+            key = domain_key(domain)
+            tasks = prepared(domain, key)
+            if tasks is not None:
+                logging.info("Already prepared: " + str(domain))
+        if key is None or tasks is None:
+            tasks = prepare(domain)
+            if tasks is None:
+                # not recorded, so that a rerun tries again
+                tasks = []
+            elif key is not None:
+                manifest.record("domain", domain, key, instances=tasks)
+    except (Exception, SystemExit) as e:
+        # SystemExit is raised on parse errors, and must not end
+        # the worker without its result reaching the parent
+        logging.error(repr(e) + ":" + str(domain))
+        stager.remove(os.path.join(args.output, domain))
+        tasks = []
+    if emit is not None:
+        for outdir in tasks:
+            emit(outdir)
+    if cache is not None:
+        cache_stats = [a - b for a, b in zip(cache.stats(), cache_stats)]
+    return tasks, records.records, stager, cache_stats
+
+
+def produce(domain_queue, solve_queue, result_queue):
+    init_worker()
+    while True:
+        domain = domain_queue.get()
+        if domain is None:
+            break
+        emitted = []
+        def emit(outdir):
+            emitted.append(outdir)
+            # blocks while the solvers are behind
+            solve_queue.put(outdir)
+        result = prepare_domain(domain, emit)
+        result_queue.put((result, len(emitted)))
+
+
+def attempt(job):
+    outdir, time_limit = job
+    return outdir, solve(outdir, time_limit)
+
+
+def consume(solve_queue, done_queue, time_limit):
+    while True:
+        outdir = solve_queue.get()
+        if outdir is None:
+            break
+        try:
+            result = attempt((outdir, time_limit))
+        except Exception as e:
+            # a dead solver would leave the producers
+            # blocked on the full solve queue
+            logging.error(repr(e) + ":" + str(outdir))
+            result = (outdir, None)
+        done_queue.put(result)
+
+
+def pipeline(domains, num_cpus, on_result, time_limit):
+    """Prepare the domains and solve their instances at the same time:
+    the instances of each domain are queued for solving as soon as
+    the domain is prepared. Returns the instances that reached the
+    time limit."""
+    num_producers = args.producers
+    if num_producers is None:
+        num_producers = max(1, num_cpus // 4)
+    num_producers = max(1, min(num_producers, len(domains)))
+    num_solvers = max(1, num_cpus - num_producers)
+    queue_size = args.queue_size
+    if queue_size is None:
+        queue_size = 2 * num_cpus
+    domain_queue = multiprocessing.Queue()
+    for domain in domains:
+        domain_queue.put(domain)
+    for _ in range(num_producers):
+        domain_queue.put(None)
+    solve_queue = multiprocessing.Queue(queue_size)
+    result_queue = multiprocessing.Queue()
+    done_queue = multiprocessing.Queue()
+    producers = [
+        multiprocessing.Process(
+            target=produce,
+            args=(domain_queue, solve_queue, result_queue))
+        for _ in range(num_producers)]
+    solvers = [
+        multiprocessing.Process(
+            target=consume,
+            args=(solve_queue, done_queue, time_limit))
+        for _ in range(num_solvers)]
+    for proc in producers + solvers:
+        proc.start()
+    num_emitted = 0
+    num_results = 0
+    progress = tqdm(total=len(domains))
+    for result, emitted in receive(result_queue, producers):
+        num_emitted += emitted
+        num_results += 1
+        on_result(result)
+        progress.update()
+    progress.close()
+    if num_results < len(domains):
+        logging.error("{} domains lost with a crashed producer".format(
+            len(domains) - num_results))
+    for proc in producers:
+        proc.join()
+    for _ in range(num_solvers):
+        solve_queue.put(None)
+    timeouts = []
+    progress = tqdm(total=num_emitted)
+    for outdir, returncode in receive(done_queue, solvers):
+        if returncode == TIMEOUT:
+            timeouts.append(outdir)
+        progress.update()
+    progress.close()
+    for proc in solvers:
+        proc.join()
+    return timeouts
+
+
+def receive(result_queue, procs, timeout=1.0):
+    """The items put on the queue by the processes, until they have
+    all exited. A process that crashes does not leave the caller
+    waiting for the items it did not put."""
+    while True:
+        # checked before waiting: the items of a process are
+        # all in the queue once it has exited
+        alive = any(proc.is_alive() for proc in procs)
+        try:
+            item = result_queue.get(timeout=timeout)
+        except queue.Empty:
+            if not alive:
+                return
+            continue
+        yield item
+
+
+def retry(timeouts, num_cpus, limits, times):
+    """Solve the instances that timed out again, with each of the
+    larger limits in turn, the longest expected ones first."""
+    for time_limit in limits:
+        if not timeouts:
+            break
+        logging.info("Solving {} instances again with {}s".format(
+            len(timeouts), time_limit))
+        jobs = [(outdir, time_limit)
+                for outdir in longest_first(timeouts, times)]
+        timeouts = []
         with multiprocessing.Pool(num_cpus) as p:
-            _ = list(tqdm(p.imap_unordered(solve, instances), total=len(instances)))
+            results = p.imap_unordered(attempt, jobs)
+            for outdir, returncode in tqdm(results, total=len(jobs)):
+                if returncode == TIMEOUT:
+                    timeouts.append(outdir)
+
+
+def get_num_cpus():
+    num_cpus = multiprocessing.cpu_count()
+    if args.num_cpus is not None:
+        num_cpus = args.num_cpus
+    return num_cpus
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s %(levelname)-8s %(message)s",
+        datefmt="%m-%d %H:%M",
+        filename="log",
+        filemode="w")
+    cache = None
+    if args.cache_dir is not None:
+        cache = parse_cache.configure(
+            args.cache_dir, args.cache_size * 1024 * 1024)
+    times = dict()
+    if args.manifest is not None:
+        manifest = Manifest(args.manifest)
+        times = history(manifest.entries("solve"))
+    if args.solve:
+        plan_cache = None
+        if args.plan_cache is not None:
+            plan_cache = PlanCache(args.plan_cache)
+        results_table = args.results
+        if results_table is None:
+            results_table = os.path.join(args.output, "results.csv")
+        runner.open_table(results_table)
+        solver = runner.Solver(
+            [args.downward], planner_id(args.downward),
+            results_table, manifest,
+            plan_cache, args.memory_limit, args.cpu_limit)
+    domains = list(filter(
+        lambda x: os.path.isdir(os.path.join(args.input, x)),
+        os.listdir(args.input)))
+    if args.solve:
+        # the instances of the domains that took longest
+        # in earlier runs are queued for solving first
+        domain_times = dict()
+        for outdir, elapsed in times.items():
+            domain = os.path.relpath(outdir, args.output).split(os.sep)[0]
+            domain_times[domain] = domain_times.get(domain, 0.0) + elapsed
+        domains = longest_first(domains, domain_times)
+    instances = []
+    num_cpus = get_num_cpus()
+    total_stager = Stager()
+    def on_result(result):
+        tasks, messages, domain_stager, cache_stats = result
+        for level, msg in messages:
+            logging.log(level, msg)
+        instances.extend(tasks)
+        total_stager.merge(domain_stager)
+        if cache is not None:
+            cache.add_stats(cache_stats)
+    if args.solve:
+        limits = time_limits(
+            seconds(args.initial_time_limit),
+            seconds(args.time_limit),
+            args.time_limit_factor)
+        timeouts = pipeline(domains, num_cpus, on_result, limits[0])
+        retry(timeouts, num_cpus, limits[1:], times)
+        harvest_table = args.harvest
+        if harvest_table is None:
+            harvest_table = os.path.join(args.output, "harvest.csv")
+        num_rows = harvest(
+            args.output, harvest_table, results_table,
+            instances, num_cpus, args.loose_white_list)
+        logging.info("{} instances harvested into {}".format(
+            num_rows, harvest_table))
+    else:
+        with multiprocessing.Pool(num_cpus, initializer=init_worker) as p:
+            results = p.imap_unordered(prepare_domain, domains)
+            for result in tqdm(results, total=len(domains)):
+                on_result(result)
+    if cache is not None:
+        logging.info(cache.report())
+    logging.info(total_stager.report())
@@ -0,0 +1,113 @@
+import os
+import json
+import hashlib
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+
+def digest(paths: Iterable[str], *extra: Any) -> str:
+    """The SHA-256 hash of the contents of the files and of the
+    extra values, which together identify the inputs of a step."""
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        h.update(b"\0")
+    for value in extra:
+        h.update(repr(value).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def planner_id(path: str) -> str:
+    """Identifies the installed planner, so that solving is
+    redone after an upgrade. For the fast-downward driver, the
+    search binary of its release build is what changes."""
+    paths = [path]
+    build = os.path.join(
+        os.path.dirname(os.path.abspath(path)),
+        "builds", "release", "bin", "downward")
+    if os.path.exists(build):
+        paths.append(build)
+    parts = []
+    for p in paths:
+        try:
+            stat = os.stat(p)
+            parts.append("{}:{}:{}".format(
+                os.path.realpath(p), stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            parts.append(p)
+    return ";".join(parts)
+
+
+class Manifest:
+    """Append-only record of the completed steps of a run,
+    one JSON object per line, so that a rerun can skip the
+    steps that are done and whose inputs have not changed.
+
+    Every entry has a kind (the step), a name (what the step
+    was applied to) and a key (the digest of its inputs); the
+    last entry of a kind and name wins. Entries are appended
+    with a single write each, so processes can share a file,
+    and a line cut short by a crash is ignored."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._entries = dict()
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line)
+                self._entries[(entry["kind"], entry["name"])] = entry
+            except (ValueError, KeyError, TypeError):
+                continue
+        if data and not data.endswith(b"\n"):
+            # end the damaged line, not to corrupt the next one
+            self._append(b"\n")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(
+            self,
+            kind: str,
+            name: str,
+            key: str) -> Optional[Dict[str, Any]]:
+        """The entry of the step if it is done with these inputs."""
+        entry = self._entries.get((kind, name))
+        if entry is None or entry["key"] != key:
+            return None
+        return entry
+
+    def entries(self, kind: str) -> Iterator[Dict[str, Any]]:
+        for (k, _), entry in self._entries.items():
+            if k == kind:
+                yield entry
+
+    def record(
+            self,
+            kind: str,
+            name: str,
+            key: str,
+            **fields: Any) -> None:
+        entry = dict(fields, kind=kind, name=name, key=key)
+        line = json.dumps(entry, sort_keys=True) + "\n"
+        self._append(line.encode())
+        self._entries[(kind, name)] = entry
+
+    def _append(self, data: bytes) -> None:
+        # opened for every entry, so that forked
+        # processes never share a file offset
+        fd = os.open(
+            self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
@@ -0,0 +1,95 @@
+from typing import Iterator, List, Optional, Tuple
+from domain import Domain
+from candidates import CandidateIndex
+from operations import *
+from fd.pddl.actions import Action
+from fd.pddl.conditions import Conjunction, Literal, NegatedAtom
+
+
+def _precondition(action: Action) -> List[Literal]:
+    atoms = (action.precondition,)
+    if isinstance(action.precondition, Conjunction):
+        atoms = action.precondition.parts
+    return [atom for atom in atoms if isinstance(atom, Literal)]
+
+
+def _has_neg_prec(domain: Domain) -> bool:
+    for action in domain.actions:
+        for atom in _precondition(action):
+            if isinstance(atom, NegatedAtom):
+                return True
+    return False
+
+
+def _insertions(
+        action: Action,
+        neg_prec: bool) -> List[Tuple[type, bool, List[Literal]]]:
+    # the kinds of insertion that apply to the action, with
+    # the literals each kind must not insert a second time
+    effects = [eff.literal for eff in action.effects]
+    precondition = _precondition(action)
+    insertions = [
+        (EffInsertion, False, effects),
+        (EffInsertion, True, effects),
+        (PrecondInsertion, False, precondition)]
+    if neg_prec:
+        insertions.append((PrecondInsertion, True, precondition))
+    return insertions
+
+
+def num_mutants(
+        domain: Domain,
+        index: Optional[CandidateIndex] = None) -> int:
+    """The number of single-edit mutants of the domain."""
+    if index is None:
+        index = CandidateIndex(domain.predicates)
+    neg_prec = _has_neg_prec(domain)
+    count = 0
+    for action in domain.actions:
+        for _, negated, existing in _insertions(action, neg_prec):
+            count += index.count(action, negated, existing)
+        count += len(action.effects)
+        count += len(_precondition(action))
+    return count
+
+
+def mutants(
+        domain: Domain,
+        index: Optional[CandidateIndex] = None,
+        shard: int = 0,
+        num_shards: int = 1) -> Iterator[Tuple[int, Operation]]:
+    """Lazily yield every single-edit mutant of the domain as
+    an (id, operation) pair; the operations are not applied.
+
+    Mutants are numbered in a fixed order: action by action, the
+    positive and negative effect insertions, the positive (and, if
+    the domain has negative preconditions at all, negative)
+    precondition insertions, then the effect deletions and the
+    precondition deletions. The ids only depend on the domain,
+    so shard k of n, which yields the mutants whose id is k
+    modulo n, can be computed anywhere without coordination."""
+    if not 0 <= shard < num_shards:
+        msg = "Invalid shard {} of {}".format(shard, num_shards)
+        raise ValueError(msg)
+    if index is None:
+        index = CandidateIndex(domain.predicates)
+    neg_prec = _has_neg_prec(domain)
+    base = 0
+    for action in domain.actions:
+        for op, negated, existing in _insertions(action, neg_prec):
+            codes = index.codes(action, negated, existing)
+            # only decode the codes of this shard
+            start = (shard - base) % num_shards
+            mutant_id = base + start
+            for atom in index.decode(
+                    action, negated, codes[start::num_shards]):
+                yield mutant_id, op(action, atom)
+                mutant_id += num_shards
+            base += len(codes)
+        deletions = [(EffDeletion, eff.literal) for eff in action.effects]
+        deletions += [(PrecondDeletion, atom)
+                      for atom in _precondition(action)]
+        for op, atom in deletions:
+            if base % num_shards == shard:
+                yield base, op(action, atom)
+            base += 1
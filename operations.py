@@ -29,10 +29,46 @@ class Operation:
     def __init__(self, action, atom):
         self.action = action
         self.atom = atom
+        self._applied = False
     
     def apply(self) -> None:
         raise NotImplementedError
 
+    def revert(self) -> None:
+        raise NotImplementedError
+
+    def _unapply(self) -> None:
+        # marks the operation as reverted, which it must not be yet
+        if not self._applied:
+            msg = "Operation not applied: {}".format(self)
+            raise InvalidOperationError(msg)
+        self._applied = False
+
+
+class Transaction:
+    """Operations applied to a domain in order, which
+    are reverted in reverse order by rollback.
+
+    Given the actions of the domain, the transaction
+    rejects operations on the actions of other domains."""
+    def __init__(self, actions=None):
+        self.ops = []
+        self._actions = None
+        if actions is not None:
+            self._actions = set(id(action) for action in actions)
+
+    def apply(self, op: Operation) -> None:
+        if (self._actions is not None
+                and id(op.action) not in self._actions):
+            msg = "Operation on an action of another domain: {}".format(op)
+            raise InvalidOperationError(msg)
+        op.apply()
+        self.ops.append(op)
+
+    def rollback(self) -> None:
+        while self.ops:
+            self.ops.pop().revert()
+
 
 class EffInsertion(Operation):
     def __str__(self) -> str:
@@ -60,6 +96,22 @@ class EffInsertion(Operation):
                 raise InvalidOperationError(msg)
         eff = Effect([], Truth(), self.atom)
         self.action.effects.append(eff)
+        self._effect = eff
+        self._applied = True
+
+    def revert(self) -> None:
+        self._unapply()
+        effects = self.action.effects
+        if effects and effects[-1] is self._effect:
+            effects.pop()
+            return
+        for idx, eff in enumerate(effects):
+            if eff is self._effect:
+                effects.pop(idx)
+                return
+        msg = "Inserted effect not found: {} and {}".format(
+                self.atom, self.action.name)
+        raise InvalidOperationError(msg)
 
 
 class EffDeletion(Operation):
@@ -86,7 +138,13 @@ class EffDeletion(Operation):
             msg = "Invalid effect: {} and {}".format(
                     self.atom, self.action.name)
             raise InvalidOperationError(msg)
-        self.action.effects.pop(pop_idx)
+        self._effect = self.action.effects.pop(pop_idx)
+        self._pop_idx = pop_idx
+        self._applied = True
+
+    def revert(self) -> None:
+        self._unapply()
+        self.action.effects.insert(self._pop_idx, self._effect)
 
 
 class PrecondInsertion(Operation):
@@ -115,7 +173,13 @@ class PrecondInsertion(Operation):
             atoms = self.action.precondition.parts
         new_prec = [a for a in atoms]
         new_prec.append(self.atom)
+        self._precondition = self.action.precondition
         self.action.precondition = Conjunction(new_prec)
+        self._applied = True
+
+    def revert(self) -> None:
+        self._unapply()
+        self.action.precondition = self._precondition
 
 class PrecondDeletion(Operation):
     def __str__(self) -> str:
@@ -146,4 +210,10 @@ class PrecondDeletion(Operation):
                     self.atom, self.action.name)
             raise InvalidOperationError(msg)
         atoms.pop(pop_idx)
+        self._precondition = self.action.precondition
         self.action.precondition = Conjunction(atoms)
+        self._applied = True
+
+    def revert(self) -> None:
+        self._unapply()
+        self.action.precondition = self._precondition
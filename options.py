@@ -14,6 +14,9 @@ parser.add_argument(
 parser.add_argument(
         "--outOperations", type=str,
         help="output directory of the operations")
+parser.add_argument(
+        "--canonical", action="store_true",
+        help="write the domain in canonical order")
 
 
 def setup():
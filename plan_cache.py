@@ -0,0 +1,134 @@
+import os
+import json
+import shutil
+import tempfile
+from typing import Any, Optional, Tuple
+
+from manifest import digest
+
+# exit codes of fast-downward that only depend on the task,
+# the planner and the time limit, and so can be reused
+REUSABLE = (0, 12, 23)
+
+
+class PlanCache:
+    """Content-addressed store of planner results.
+
+    An entry is the exit code of the planner and the plan it found,
+    if any, stored under the digest of the domain and task files and
+    of the planner configuration, along with a copy of the output.sas
+    file of the run, so that reused results keep their SAS header. Instances that are byte-identical
+    (loose white-list copies, mutants with the same edit, nightly
+    reruns of the same benchmarks) then run the planner once."""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, domain_file: str, task_file: str, *config: Any) -> str:
+        return digest([domain_file, task_file], *config)
+
+    def _path(self, key: str, suffix: str = ".json") -> str:
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def load(
+            self,
+            key: str) -> Optional[Tuple[int, Optional[str], Optional[str]]]:
+        """The exit code, plan and cached output.sas file
+        of the entry, or None."""
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+            sas_file = None
+            if entry.get("sas"):
+                sas_file = self._path(key, ".sas")
+                if not os.path.isfile(sas_file):
+                    raise ValueError("missing output.sas")
+            result = entry["returncode"], entry["plan"], sas_file
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (ValueError, KeyError, TypeError, OSError):
+            # a damaged entry is a miss, overwritten by the next store
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def store(
+            self,
+            key: str,
+            returncode: int,
+            plan_file: Optional[str] = None,
+            sas_file: Optional[str] = None) -> None:
+        if returncode not in REUSABLE:
+            return
+        plan = None
+        if returncode == 0 and plan_file is not None:
+            try:
+                with open(plan_file) as f:
+                    plan = f.read()
+            except FileNotFoundError:
+                # solved without a plan file: nothing to reuse
+                return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        has_sas = sas_file is not None and os.path.isfile(sas_file)
+        if has_sas:
+            # a copy, as the planner rewrites output.sas in place;
+            # stored before the entry that refers to it
+            self._copy(sas_file, self._path(key, ".sas"))
+        self._write(path, json.dumps(
+            {"returncode": returncode, "plan": plan, "sas": has_sas}))
+
+    def _copy(self, src: str, path: str) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _write(self, path: str, text: str) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            # atomic, so concurrent readers never see partial entries
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def restore(
+            self,
+            entry: Tuple[int, Optional[str], Optional[str]],
+            plan_file: str,
+            sas_file: Optional[str] = None) -> int:
+        """Write the plan and output.sas of a loaded entry, if any,
+        to plan_file and sas_file, and return the exit code of the
+        planner run it records. Files of earlier runs are removed."""
+        returncode, plan, cached_sas = entry
+        for path in (plan_file, sas_file):
+            if path is None:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        if plan is not None:
+            with open(plan_file, "w") as f:
+                f.write(plan)
+        if sas_file is not None and cached_sas is not None:
+            shutil.copyfile(cached_sas, sas_file)
+        return returncode
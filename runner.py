@@ -0,0 +1,215 @@
+import os
+import time
+import logging
+import resource
+import subprocess
+import tempfile
+from typing import Callable, List, NamedTuple, Optional
+
+from manifest import Manifest, digest
+from plan_cache import PlanCache
+from schedule import finished
+
+
+class Usage(NamedTuple):
+    """What a process and the children it waited for used."""
+    returncode: int
+    wall: float
+    user: float
+    system: float
+    # in kilobytes, as reported by the kernel
+    maxrss: int
+
+
+class Result(NamedTuple):
+    returncode: int
+    stdout: bytes
+    stderr: bytes
+    usage: Usage
+
+
+# the configuration of fast-downward used to solve the instances
+ALIAS = "lama-first"
+
+FIELDS = ["name", "time_limit", "returncode",
+          "wall", "user", "system", "maxrss"]
+
+
+def limiter(
+        memory: Optional[int] = None,
+        cpu_time: Optional[int] = None) -> Optional[Callable[[], None]]:
+    """A hook limiting the address space (in MB) and the cpu time
+    (in seconds) of a child process and of its own children, to be
+    run in the child before it executes the command."""
+    if memory is None and cpu_time is None:
+        return None
+
+    def hook() -> None:
+        if memory is not None:
+            limit = memory * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        if cpu_time is not None:
+            # SIGXCPU at the soft limit, SIGKILL one second later
+            resource.setrlimit(
+                resource.RLIMIT_CPU, (cpu_time, cpu_time + 1))
+    return hook
+
+
+def run(
+        cmd: List[str],
+        memory: Optional[int] = None,
+        cpu_time: Optional[int] = None) -> Result:
+    """Run the command under the resource limits and measure it.
+
+    The output goes to temporary files rather than pipes, so the
+    child can be reaped with os.wait4, which is what reports its
+    resource usage, without risking a full pipe blocking it."""
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            cmd, stdout=out, stderr=err,
+            preexec_fn=limiter(memory, cpu_time))
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        out.seek(0)
+        err.seek(0)
+        stdout, stderr = out.read(), err.read()
+    usage = Usage(
+        proc.returncode, wall, rusage.ru_utime,
+        rusage.ru_stime, rusage.ru_maxrss)
+    return Result(proc.returncode, stdout, stderr, usage)
+
+
+def open_table(path: str) -> None:
+    """Create the results table with its header, unless it exists."""
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        return
+    try:
+        os.write(fd, (",".join(FIELDS) + "\n").encode())
+    finally:
+        os.close(fd)
+
+
+def record(
+        path: str,
+        name: str,
+        time_limit: Optional[int],
+        usage: Usage) -> None:
+    """Append the measurements of one run to the results table.
+    Rows are appended with a single write each, so that the
+    worker processes can share the table."""
+    name = '"{}"'.format(name.replace('"', '""'))
+    row = [name, "" if time_limit is None else str(time_limit),
+           str(usage.returncode), "{:.3f}".format(usage.wall),
+           "{:.3f}".format(usage.user), "{:.3f}".format(usage.system),
+           str(usage.maxrss)]
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (",".join(row) + "\n").encode())
+    finally:
+        os.close(fd)
+
+
+class Solver:
+    """Runs the planner on instances, for main.py and generator.py.
+
+    A run is skipped if the manifest records one that makes it
+    useless, and reused if the plan cache has the result of an
+    identical instance; otherwise the planner runs under the
+    resource limits. Either way, the result goes to the results
+    table, to the manifest and to the plan cache."""
+
+    def __init__(
+            self,
+            downward: List[str],
+            planner: str,
+            table: str,
+            manifest: Optional[Manifest] = None,
+            plan_cache: Optional[PlanCache] = None,
+            memory: Optional[int] = None,
+            cpu_time: Optional[int] = None,
+            alias: str = ALIAS) -> None:
+        # the command running fast-downward, and the identity of
+        # the planner and its alias, which are part of every key
+        self.downward = downward
+        self.planner = planner
+        self.alias = alias
+        self.table = table
+        self.manifest = manifest
+        self.plan_cache = plan_cache
+        self.memory = memory
+        self.cpu_time = cpu_time
+
+    def command(
+            self,
+            domain_file: str,
+            task_file: str,
+            plan_file: str,
+            sas_file: str,
+            time_limit: int) -> List[str]:
+        return self.downward + [
+            "--alias", self.alias,
+            "--overall-time-limit", str(time_limit),
+            "--plan-file", plan_file,
+            "--sas-file", sas_file,
+            domain_file, task_file]
+
+    def solve(
+            self,
+            domain_file: str,
+            task_file: str,
+            outdir: str,
+            plan_file: str,
+            sas_file: str,
+            time_limit: int,
+            on_run: Optional[Callable[[List[str], Result], None]] = None
+            ) -> int:
+        """Solve the instance with the time limit in seconds and
+        return the exit code of the planner. on_run is called with
+        the command and its result, when the planner actually runs."""
+        cmd = self.command(
+            domain_file, task_file, plan_file, sas_file, time_limit)
+        key = None
+        if self.manifest is not None:
+            # the time limit is not part of the key: a run that did not
+            # time out gives the result of any run with a larger limit
+            key = digest(
+                [domain_file, task_file], self.planner, self.alias)
+            entry = self.manifest.lookup("solve", outdir, key)
+            if finished(entry, time_limit):
+                return entry["returncode"]
+        usage = None
+        elapsed = None
+        if self.plan_cache is not None:
+            cache_key = self.plan_cache.key(
+                domain_file, task_file, self.planner, self.alias,
+                time_limit)
+            cached = self.plan_cache.load(cache_key)
+            if cached is not None:
+                returncode = self.plan_cache.restore(
+                    cached, plan_file, sas_file)
+                logging.info("Reusing a cached plan: {}".format(outdir))
+                # a reused result takes no planner time
+                usage = Usage(returncode, 0.0, 0.0, 0.0, 0)
+        if usage is None:
+            result = run(cmd, self.memory, self.cpu_time)
+            usage = result.usage
+            elapsed = usage.wall
+            if self.plan_cache is not None:
+                self.plan_cache.store(
+                    cache_key, usage.returncode, plan_file, sas_file)
+            if on_run is not None:
+                on_run(cmd, result)
+        record(self.table, outdir, time_limit, usage)
+        # a planner killed by a signal has not finished
+        if key is not None and usage.returncode >= 0:
+            self.manifest.record(
+                "solve", outdir, key, returncode=usage.returncode,
+                time_limit=time_limit, elapsed=elapsed)
+        return usage.returncode
@@ -0,0 +1,68 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+# exit code of fast-downward when it reaches its time limit
+TIMEOUT = 23
+
+_UNITS = {"s": 1, "m": 60, "h": 3600}
+
+
+def seconds(limit: str) -> int:
+    """A time limit as given to fast-downward ("900", "15m", "1h")."""
+    limit = str(limit).strip()
+    unit = _UNITS.get(limit[-1:])
+    if unit is None:
+        return int(float(limit))
+    return int(float(limit[:-1]) * unit)
+
+
+def time_limits(initial: int, maximum: int, factor: float) -> List[int]:
+    """The time limits of the successive attempts to solve a task:
+    every task is first run with the initial limit, and the ones
+    that time out are run again with limits growing by the factor,
+    the last attempt having the maximal limit."""
+    limits = []
+    limit = max(1, min(initial, maximum))
+    while limit < maximum:
+        limits.append(limit)
+        limit = max(limit + 1, int(limit * factor))
+    limits.append(maximum)
+    return limits
+
+
+def finished(entry: Optional[Dict[str, Any]], maximum: int) -> bool:
+    """Whether a recorded planner run needs no further attempt:
+    it did not time out, or it had at least the maximal limit."""
+    if entry is None:
+        return False
+    if entry["returncode"] != TIMEOUT:
+        return True
+    return entry.get("time_limit", 0) >= maximum
+
+
+def history(entries: Iterable[Dict[str, Any]]) -> Dict[str, float]:
+    """The time taken by the recorded planner runs, by name.
+    A run that timed out took at least its time limit."""
+    times = dict()
+    for entry in entries:
+        elapsed = entry.get("elapsed")
+        if entry.get("returncode") == TIMEOUT:
+            # the elapsed time is unknown for reused results
+            elapsed = max(elapsed or 0, entry.get("time_limit", 0))
+        if elapsed is not None:
+            times[entry["name"]] = elapsed
+    return times
+
+
+def longest_first(
+        names: Iterable[Any],
+        times: Dict[str, float],
+        key=lambda name: name) -> List[Any]:
+    """Order the work by decreasing expected time, so that the
+    longest tasks do not start last and stretch the makespan.
+    Tasks without history are expected to be the longest: their
+    time is unknown, and most tasks with history are quick."""
+    unknown = float("inf")
+    return sorted(
+        names,
+        key=lambda name: times.get(key(name), unknown),
+        reverse=True)
@@ -0,0 +1,102 @@
+import os
+import time
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request cloning a file on copy-on-write file systems
+# (btrfs, xfs, ...); from linux/fs.h
+FICLONE = 0x40049409
+
+
+class Stager:
+    """Copies and removes files in-process, instead of
+    forking a cp or rm process for every file.
+
+    Copies are reflinks where the file system supports them,
+    hard links where it does not, and plain copies otherwise.
+    As a hard link shares the file with its source, a staged
+    file must be released before it is rewritten in place."""
+
+    def __init__(self) -> None:
+        self.reflinks = 0
+        self.links = 0
+        self.copies = 0
+        self.removals = 0
+        self.elapsed = 0.0
+        self._dirs = set()
+
+    @property
+    def num_ops(self) -> int:
+        # every operation used to be one forked process
+        return self.reflinks + self.links + self.copies + self.removals
+
+    def makedirs(self, *paths: str) -> None:
+        for path in paths:
+            if path in self._dirs:
+                continue
+            os.makedirs(path, exist_ok=True)
+            self._dirs.add(path)
+
+    def copy(self, src: str, dst: str) -> None:
+        start = time.perf_counter()
+        try:
+            self.release(dst)
+            if self._reflink(src, dst):
+                self.reflinks += 1
+                return
+            try:
+                os.link(src, dst)
+                self.links += 1
+                return
+            except OSError:
+                pass
+            shutil.copyfile(src, dst)
+            self.copies += 1
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def _reflink(self, src: str, dst: str) -> bool:
+        if fcntl is None:
+            return False
+        with open(src, "rb") as fsrc:
+            try:
+                with open(dst, "wb") as fdst:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return True
+            except OSError:
+                self.release(dst)
+                return False
+
+    def release(self, path: str) -> None:
+        # unlink the path, so that writing to it creates
+        # a new file instead of going through a hard link
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def remove(self, path: str) -> None:
+        start = time.perf_counter()
+        shutil.rmtree(path, ignore_errors=True)
+        self._dirs = set(
+            d for d in self._dirs
+            if d != path and not d.startswith(path + os.sep))
+        self.removals += 1
+        self.elapsed += time.perf_counter() - start
+
+    def merge(self, other: "Stager") -> None:
+        self.reflinks += other.reflinks
+        self.links += other.links
+        self.copies += other.copies
+        self.removals += other.removals
+        self.elapsed += other.elapsed
+
+    def report(self) -> str:
+        return ("staging: {} forks avoided ({} reflinks, {} links, "
+                "{} copies, {} removals) in {:.2f}s").format(
+                    self.num_ops, self.reflinks, self.links,
+                    self.copies, self.removals, self.elapsed)
@@ -1,6 +1,6 @@
 import os.path
 
-from domain import Domain
+from domain import Domain, domain_pddl
 from fd.pddl.predicates import *
 from fd.pddl.actions import *
 from fd.pddl.conditions import *
@@ -11,17 +11,44 @@ from fd.pddl.tasks import *
 import argparse
 
 
+class ActionMismatchError(Exception):
+    def __init__(self, missing, extra):
+        self.missing = missing
+        self.extra = extra
+        self.msg = "Mismatched actions between the domains"
+        if missing:
+            self.msg += ", missing: " + " ".join(missing)
+        if extra:
+            self.msg += ", extra: " + " ".join(extra)
+
+    def __str__(self):
+        return self.msg
+
+    def __repr__(self):
+        return str(self)
+
+
 class Transformer:
     def __init__(
             self,
             dx: Domain,
-            dy: Domain):
+            dy: Domain,
+            canonical: bool = False):
+        # In canonical mode, the compiled domain and tasks are
+        # written with their unordered parts sorted, so that equal
+        # compilations give byte-identical files.
+        self._canonical = canonical
+        # The x actions are extended with the lock and unlock
+        # effects and precondition; they are compiled on a clone,
+        # which leaves dx unchanged for other transformers.
+        dx = dx.clone()
         self._pred_mapping = dict()
-        action_mapping = dict()
-        for y_action in dy.actions:
-            for a in dx.actions:
-                if y_action.name == a.name:
-                    action_mapping[y_action] = a
+        x_actions = {a.name: a for a in dx.actions}
+        y_names = set(y_action.name for y_action in dy.actions)
+        missing = [name for name in y_names if name not in x_actions]
+        extra = [name for name in x_actions if name not in y_names]
+        if missing or extra:
+            raise ActionMismatchError(sorted(missing), sorted(extra))
         for pred in dy.predicates:
             self._pred_mapping[pred.name] = Predicate(
                     pred.name+"-copy",
@@ -32,7 +59,7 @@ class Transformer:
         extended_preds.append(Predicate(x_atom.predicate, x_atom.args))
         extended_actions = list()
         for y_action in dy.actions:
-            x_action = action_mapping[y_action]
+            x_action = x_actions[y_action.name]
             y_atom = Atom(y_action.name+"-lock", y_action.parameters)
             extended_preds.append(Predicate(y_atom.predicate, y_atom.args))
             new_eff = Effect([], Truth(), y_atom)
@@ -99,6 +126,8 @@ class Transformer:
         self._predicates = dx.predicates + extended_preds
         self._functions = dx.functions
         self._axioms = dx.axioms
+        self._domain_body = None
+        self._domain_file = None
 
     def output_task(self, task_file, path):
         parsed_file = parse_pddl_file(
@@ -108,51 +137,79 @@ class Transformer:
          task_requirements,
          objects, init,
          goal, use_metric) = parse_task(parsed_file)
+        del parsed_file
         goal = list(goal.parts)
+        if self._canonical:
+            goal.sort(key=lambda part: part.pddl())
+            objects.sort(key=lambda obj: obj.name)
+            init.sort(key=_fact_key)
         goal.append(Atom("invalid", []))
         goal = Conjunction(goal)
-        extension = [Atom("unlock-origin-domain", [])]
-        for atom in init:
-            if not isinstance(atom, Atom):
-                extension.append(atom)
-            else:
-                extension.append(
-                        Atom(self._pred_mapping[atom.predicate].name, atom.args))
-        init = init + extension
-        metric = ""
-        objects = set(objects) - set(self._constants)
-        if use_metric:
-            metric = "(:metric minimize (total-cost) )"
-        body = "(define (problem {problem})\
-                       (:domain {domain_name})\
-                       (:objects {0}) \
-                       (:init {1}) \
-                       (:goal {2}) \
-                       {metric})".format('\n'.join(x.pddl() for x in set(objects)),
-                                         '\n'.join(x.pddl() for x in set(init)),
-                                         goal.pddl(), metric=metric,
-                                         problem=task_name,
-                                         domain_name=self._domain_name)
-        with open(os.path.join(path, "task.pddl"), "w") as f:
-            f.write(body)
+        constants = set(self._constants)
+        # The init facts are written as they are read, each followed
+        # by its copy twin. The facts of the task are unique, and so
+        # are their twins; the set only holds references to the facts
+        # of the task, for the rare twin equal to one of them.
+        with open(os.path.join(path, "task.pddl"), "w",
+                  buffering=1 << 16) as f:
+            f.write("(define (problem {})\n".format(task_name))
+            f.write("(:domain {})\n".format(self._domain_name))
+            f.write("(:objects")
+            seen = set()
+            for obj in objects:
+                if obj not in constants and obj not in seen:
+                    seen.add(obj)
+                    f.write("\n")
+                    f.write(obj.pddl())
+            f.write(")\n(:init\n")
+            f.write(Atom("unlock-origin-domain", []).pddl())
+            seen = set(init)
+            for fact in init:
+                f.write("\n")
+                f.write(str(fact.pddl()))
+                if not isinstance(fact, Atom):
+                    continue
+                name = self._pred_mapping[fact.predicate].name
+                twin = Atom(name, fact.args)
+                if twin not in seen:
+                    f.write("\n")
+                    f.write(twin.pddl())
+            f.write(")\n(:goal {})\n".format(goal.pddl()))
+            if use_metric:
+                f.write("(:metric minimize (total-cost) )\n")
+            f.write(")\n")
 
     def output_domain(self, path):
-        body = ("(define (domain {domain_name})\n"
-                "{requirements}\n"
-                "(:types\n\t{types})\n"
-                "(:constants {constants})\n"
-                "(:predicates\n\t{predicates})\n"
-                "(:functions {functions})\n"
-                "{actions} )").format(
-                    predicates='\n\t'.join(x.pddl() for x in self._predicates),
-                    functions='\n\t'.join(x.pddl() for x in self._functions),
-                    actions='\n\n'.join(x.pddl() for x in self._actions),
-                    types='\n\t'.join(x.pddl() for x in self._types),
-                    constants=' '.join(x.pddl() for x in self._constants),
-                    domain_name=self._domain_name,
-                    requirements=self._requirements.pddl())
-        with open(os.path.join(path, "domain.pddl"), "w") as f:
-            f.write(body)
+        # The compiled domain only depends on the domain pair: it is
+        # written once, and then hard-linked into the other paths.
+        out_file = os.path.join(path, "domain.pddl")
+        if self._domain_file is not None:
+            try:
+                if os.path.lexists(out_file):
+                    os.unlink(out_file)
+                os.link(self._domain_file, out_file)
+                return
+            except OSError:
+                pass
+        if self._domain_body is None:
+            self._domain_body = self._domain()
+        with open(out_file, "w") as f:
+            f.write(self._domain_body)
+        if self._domain_file is None:
+            self._domain_file = out_file
+
+    def _domain(self):
+        return domain_pddl(
+            self._domain_name, self._requirements, self._types,
+            self._constants, self._predicates, self._functions,
+            self._actions, self._canonical)
+
+
+def _fact_key(fact):
+    # atoms by predicate and arguments, then the numeric facts
+    if isinstance(fact, Atom):
+        return 0, fact.key
+    return 1, (fact.pddl(), ())
 
 
 parser = argparse.ArgumentParser()
@@ -171,19 +228,17 @@ parser.add_argument(
 parser.add_argument(
         "--neg_dir", type=str,
         help="path to the directory for producing negative plans")
+parser.add_argument(
+        "--canonical", action="store_true",
+        help="write the domains and tasks in canonical order")
 
 if __name__ == "__main__":
     args = parser.parse_args()
     dx = Domain(args.origin)
     dy = Domain(args.modified)
-    tp = Transformer(dx, dy)
-    # tn = Transformer(dy, dx)
+    tp = Transformer(dx, dy, args.canonical)
     tp.output_domain(args.pos_dir)
     tp.output_task(args.task, args.pos_dir)
-    # tn.output_domain(args.neg_dir)
-    # tn.output_task(args.task, args.neg_dir)
-    dx = Domain(args.modified)
-    dy = Domain(args.origin)
-    tn = Transformer(dx, dy)
+    tn = Transformer(dy, dx, args.canonical)
     tn.output_domain(args.neg_dir)
     tn.output_task(args.task, args.neg_dir)
\ No newline at end of file
@@ -1,12 +1,23 @@
-def getAllTuples(all_combs):
-    if len(all_combs) == 0:
-        return [tuple()]
-    results = set()
-    tail = all_combs.pop(-1)
-    heads = getAllTuples(all_combs)
-    for e in tail:
-        for t in heads:
-            t= list(t)
-            t.append(e)
-            results.add(tuple(t))
-    return results
\ No newline at end of file
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def countTuples(all_combs):
+    count = 1
+    for comb in all_combs:
+        count *= len(comb)
+    return count
+
+
+def getTuple(all_combs, idx):
+    # decode idx in the mixed radix given by the lengths
+    # of all_combs, with the last position varying fastest
+    t = []
+    for comb in reversed(all_combs):
+        idx, pos = divmod(idx, len(comb))
+        t.append(comb[pos])
+    t.reverse()
+    return tuple(t)
+
@@ -0,0 +1,260 @@
+import csv
+import argparse
+import multiprocessing
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from fd.pddl import pddl_file
+from fd.pddl.actions import PropositionalAction
+from fd.pddl.conditions import Atom, Impossible
+from fd.pddl.f_expression import FunctionAssignment
+
+
+class Step(NamedTuple):
+    index: int
+    action: str
+    # "ok", "unknown-action", "wrong-arguments",
+    # "inapplicable" or "unsupported"
+    verdict: str
+    detail: str
+
+
+class Verdict(NamedTuple):
+    valid: bool
+    # every step up to, and including, the first one that fails
+    steps: List[Step]
+    goal_reached: bool
+    cost: int
+    detail: str
+
+
+class _Everything:
+    """Stands for the fluent facts of Action.instantiate: every
+    atom is fluent, so that instantiating an action keeps all of
+    its conditions, to be checked against the simulated state."""
+
+    def __contains__(self, atom) -> bool:
+        return True
+
+
+EVERYTHING = _Everything()
+
+
+def read_plan(path: str) -> List[Tuple[str, List[str]]]:
+    """The steps of a plan file, as (action name, arguments)."""
+    plan = []
+    with open(path) as f:
+        for line in f:
+            line = line.split(";", 1)[0].strip()
+            if not line:
+                continue
+            words = line.strip("()").lower().split()
+            plan.append((words[0], words[1:]))
+    return plan
+
+
+class Validator:
+    """Checks plans of one planning task, parsed once, by
+    simulating them on the fd.pddl model of the task.
+
+    An action is instantiated with everything fluent, so the
+    instantiation keeps all of its precondition and effects; a
+    step is applicable if the state satisfies its precondition,
+    and is applied by removing the delete effects and then adding
+    the add effects whose conditions hold in the state before."""
+
+    def __init__(self, domain_file: str, task_file: str) -> None:
+        self.task = pddl_file.open(task_file, domain_file)
+        self._actions = {action.name: action for action in self.task.actions}
+        self._assignments = [fact for fact in self.task.init
+                             if isinstance(fact, FunctionAssignment)]
+        self._init = frozenset(fact for fact in self.task.init
+                               if isinstance(fact, Atom))
+        # without a total-cost metric, the planner counts the steps
+        self._unit_cost = not self.task.use_min_cost_metric
+        self._objects = self._objects_by_type()
+        self._object_sets = {type: set(objects) for type, objects
+                             in self._objects.items()}
+        goal = []
+        try:
+            self.task.goal.instantiate({}, (), EVERYTHING, goal)
+            self._goal = goal
+        except ValueError:
+            self._goal = None
+
+    def _objects_by_type(self) -> Dict[str, List[str]]:
+        supertypes = dict()
+        for type in self.task.types:
+            supertypes[type.name] = getattr(type, "supertype_names", [])
+        objects = defaultdict(list)
+        for obj in self.task.objects:
+            objects[obj.type].append(obj.name)
+            for type in supertypes.get(obj.type, []):
+                objects[type].append(obj.name)
+        return objects
+
+    def _instantiate(
+            self,
+            index: int,
+            name: str,
+            args: List[str]):
+        """The propositional action of a step, or the failed Step."""
+        action = self._actions.get(name)
+        text = "({})".format(" ".join([name] + args))
+        if action is None:
+            return Step(index, text, "unknown-action", name)
+        parameters = action.parameters[:action.num_external_parameters]
+        if len(parameters) != len(args):
+            return Step(index, text, "wrong-arguments",
+                        "expected {} arguments".format(len(parameters)))
+        for par, arg in zip(parameters, args):
+            if arg not in self._object_sets.get(par.type, ()):
+                return Step(index, text, "wrong-arguments",
+                            "{} is not a {}".format(arg, par.type))
+        var_mapping = {par.name: arg for par, arg in zip(parameters, args)}
+        try:
+            # the cost is looked up among the numeric assignments
+            op = action.instantiate(
+                var_mapping, self._assignments, EVERYTHING, self._objects)
+            if op is None:
+                # instantiate drops actions without effects;
+                # their precondition must still hold
+                precondition = []
+                action.precondition.instantiate(
+                    var_mapping, self._assignments, EVERYTHING,
+                    precondition)
+                op = PropositionalAction(text, precondition, [], 0)
+            return op
+        except Impossible:
+            return Step(index, text, "inapplicable", "false precondition")
+        except (ValueError, AssertionError) as err:
+            return Step(index, text, "unsupported", str(err) or repr(err))
+
+    def validate(self, plan: Iterable[Tuple[str, List[str]]]) -> Verdict:
+        state = set(self._init)
+        steps = []
+        cost = 0
+        for index, (name, args) in enumerate(plan):
+            op = self._instantiate(index, name, args)
+            if isinstance(op, Step):
+                steps.append(op)
+                return Verdict(False, steps, False, cost, op.verdict)
+            unsatisfied = [literal for literal in op.precondition
+                           if (literal.positive() in state) == literal.negated]
+            if unsatisfied:
+                steps.append(Step(
+                    index, op.name, "inapplicable",
+                    " ".join(map(str, unsatisfied))))
+                return Verdict(False, steps, False, cost, "inapplicable")
+            adds = [atom for conditions, atom in op.add_effects
+                    if self._holds(conditions, state)]
+            dels = [atom for conditions, atom in op.del_effects
+                    if self._holds(conditions, state)]
+            state.difference_update(dels)
+            state.update(adds)
+            cost += 1 if self._unit_cost else op.cost
+            steps.append(Step(index, op.name, "ok", ""))
+        if self._goal is None:
+            return Verdict(False, steps, False, cost, "unsupported goal")
+        goal_reached = self._holds(self._goal, state)
+        detail = "" if goal_reached else "goal not reached"
+        return Verdict(goal_reached, steps, goal_reached, cost, detail)
+
+    def _holds(self, literals, state) -> bool:
+        for literal in literals:
+            if (literal.positive() in state) == literal.negated:
+                return False
+        return True
+
+
+# the validators of a worker, by (domain file, task file)
+_validators = dict()
+
+
+def validate_plan(
+        job: Tuple[str, str, str]) -> Tuple[Tuple[str, str, str], Verdict]:
+    domain_file, task_file, plan_file = job
+    key = (domain_file, task_file)
+    try:
+        validator = _validators.get(key)
+        if validator is None:
+            # jobs come sorted by task: keep the current one only
+            _validators.clear()
+            validator = Validator(domain_file, task_file)
+            _validators[key] = validator
+        verdict = validator.validate(read_plan(plan_file))
+    except (Exception, SystemExit) as err:
+        verdict = Verdict(False, [], False, 0, repr(err))
+    return job, verdict
+
+
+def validate_all(
+        jobs: Iterable[Tuple[str, str, str]],
+        num_cpus: Optional[int] = None
+        ) -> Iterator[Tuple[Tuple[str, str, str], Verdict]]:
+    """Validate (domain file, task file, plan file) triples on a
+    process pool. The jobs of a task go to the same worker in
+    chunks, so each worker parses a task once per chunk."""
+    jobs = sorted(jobs)
+    if num_cpus is None:
+        num_cpus = multiprocessing.cpu_count()
+    chunksize = max(1, min(64, len(jobs) // (4 * num_cpus)))
+    if num_cpus == 1:
+        yield from map(validate_plan, jobs)
+        return
+    with multiprocessing.Pool(num_cpus) as p:
+        yield from p.imap_unordered(validate_plan, jobs, chunksize)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="validate plans against a domain and a task")
+    parser.add_argument(
+        "--domain", type=str,
+        help="domain file, to validate the given plans")
+    parser.add_argument(
+        "--task", type=str,
+        help="task file, to validate the given plans")
+    parser.add_argument(
+        "plans", nargs="*",
+        help="plan files, validated one step at a time")
+    parser.add_argument(
+        "--jobs", type=str,
+        help="csv file of domain,task,plan rows to validate in batch")
+    parser.add_argument(
+        "--out", type=str, default="verdicts.csv",
+        help="table of the verdicts of the batch")
+    parser.add_argument(
+        "--num_cpus", type=int,
+        help="number of cpus used")
+    args = parser.parse_args()
+    if args.jobs is not None:
+        with open(args.jobs, newline="") as f:
+            jobs = [tuple(row[:3]) for row in csv.reader(f) if row]
+        with open(args.out, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["domain", "task", "plan", "valid",
+                             "length", "cost", "detail"])
+            for (domain_file, task_file, plan_file), verdict in \
+                    validate_all(jobs, args.num_cpus):
+                failed = verdict.steps[-1] if verdict.steps else None
+                detail = verdict.detail
+                if failed is not None and failed.verdict != "ok":
+                    detail = "step {} {}: {} {}".format(
+                        failed.index, failed.action,
+                        failed.verdict, failed.detail)
+                writer.writerow([domain_file, task_file, plan_file,
+                                 int(verdict.valid), len(verdict.steps),
+                                 verdict.cost, detail])
+        print("{} plans validated into {}".format(len(jobs), args.out))
+    else:
+        validator = Validator(args.domain, args.task)
+        for plan_file in args.plans:
+            verdict = validator.validate(read_plan(plan_file))
+            print(plan_file)
+            for step in verdict.steps:
+                print("  {:4d} {} {} {}".format(
+                    step.index, step.action, step.verdict, step.detail))
+            print("  {} (cost {}){}".format(
+                "valid" if verdict.valid else "invalid", verdict.cost,
+                ": " + verdict.detail if verdict.detail else ""))